@@ -1,3 +1,4 @@
 # Copyright (C) 2019 Odoo Inc
 from . import models
 from . import wizard
+from . import tools
@@ -19,12 +19,16 @@
 	"account_check_printing",
     ],
     "data": [
+        "security/ir.model.access.csv",
         "data/hr.xml",
+        "data/autoliquidacion_cron.xml",
         "views/hr_payroll.xml",
         "views/account_batch_payment_views.xml",
         "report/report_payslip.xml",
         "views/autoliquidaciones.xml",
         "views/res_city_views.xml",
+        "views/master_data_import.xml",
+        "views/worked_days_catalog.xml",
     ],
     "demo": [],
     "installable": True,
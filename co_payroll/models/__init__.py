@@ -1,2 +1,4 @@
 # Copyright (C) 2019 Odoo Inc
 from . import hr
+from . import autoliquidacion
+from . import hr_payslip_run
@@ -0,0 +1,328 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from odoo import api, fields, models, tools, _
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# minimum number of seconds between two progress updates of a job
+PROGRESS_INTERVAL = 5
+
+# an interrupted job is run again, at most this many times in total
+JOB_MAX_ATTEMPTS = 3
+
+
+class AutoliquidacionJob(models.Model):
+    """ Generation of an autoliquidacion file by the scheduled action.
+
+    The scheduled action is still bound by ``limit_time_real_cron`` (which
+    defaults to ``limit_time_real``). The rendered lines of every chunk of
+    payslips are committed to the line cache as the job goes, so a job killed
+    by the time limit is queued again and starts over from the cache, up to
+    JOB_MAX_ATTEMPTS times. A file too large to be generated within that many
+    attempts needs a higher ``limit_time_real_cron`` on the server (0 for no
+    limit).
+    """
+
+    _name = "co_payroll.autoliquidacion_job"
+    _description = "Autoliquidacion Report Job"
+    _inherit = ["mail.thread"]
+    _order = "id desc"
+
+    name = fields.Char(compute="_compute_name")
+    state = fields.Selection(
+        [
+            ("queued", "En Cola"),
+            ("running", "En Proceso"),
+            ("done", "Terminado"),
+            ("failed", "Fallido"),
+        ],
+        default="queued",
+        required=True,
+        readonly=True,
+        track_visibility="onchange",
+    )
+    user_id = fields.Many2one(
+        "res.users", default=lambda self: self.env.user, required=True, readonly=True
+    )
+    parameters = fields.Text(
+        required=True,
+        readonly=True,
+        help="Values of the co_payroll.autoliquidacion_report wizard the file is "
+        "generated with.",
+    )
+    payslip_count = fields.Integer(string="Nóminas", readonly=True)
+    payslips_processed = fields.Integer(string="Nóminas Procesadas", readonly=True)
+    lines_written = fields.Integer(string="Líneas Escritas", readonly=True)
+    elapsed_time = fields.Float(string="Tiempo Transcurrido (s)", readonly=True)
+    attempts = fields.Integer(string="Intentos", readonly=True)
+    date_start = fields.Datetime(readonly=True)
+    date_end = fields.Datetime(readonly=True)
+    attachment_id = fields.Many2one("ir.attachment", readonly=True)
+    administrator_subtotals = fields.Text(
+        related="attachment_id.description",
+        string="Aportes por Administradora",
+        readonly=True,
+    )
+    error = fields.Text(readonly=True)
+
+    @api.depends("create_date")
+    def _compute_name(self):
+        for job in self:
+            job.name = _("Autoliquidacion %s") % (
+                fields.Datetime.to_string(job.create_date) or ""
+            )
+
+    @api.multi
+    def _report_progress(self, values):
+        """ Save ``values`` in a separate transaction so they can be read while
+        the job is running. """
+        with self.pool.cursor() as cr:
+            self.with_env(self.env(cr=cr)).write(values)
+
+    @api.multi
+    def _run(self):
+        self.ensure_one()
+        self.write(
+            {
+                "state": "running",
+                "date_start": fields.Datetime.now(),
+                "attempts": self.attempts + 1,
+            }
+        )
+        self.env.cr.commit()
+        started = time.time()
+
+        wizard = (
+            self.env["co_payroll.autoliquidacion_report"]
+            .sudo(self.user_id)
+            .create(json.loads(self.parameters))
+        )
+        payslip_count = self.env["hr.payslip"].search_count(
+            wizard._get_payslip_domain()
+        )
+        self._report_progress({"payslip_count": payslip_count})
+        # workers of the parallel mode read the wizard from a snapshot
+        self.env.cr.commit()
+
+        last_report = started
+
+        def progress(payslips_processed, lines_written):
+            nonlocal last_report
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                self._report_progress(
+                    {
+                        "payslips_processed": payslips_processed,
+                        "lines_written": lines_written,
+                        "elapsed_time": now - started,
+                    }
+                )
+
+        def checkpoint():
+            # keep the lines rendered so far if the job is interrupted
+            self.env.cr.commit()
+
+        def new_transaction():
+            # the progress was written by other transactions
+            self.env.cr.commit()
+            self.invalidate_cache()
+
+        # the attachment and the state of the job are saved in the same
+        # transaction, a failure leaves neither of them behind
+        attachment = wizard._create_attachment(
+            res_model=self._name,
+            res_id=self.id,
+            progress=progress,
+            checkpoint=checkpoint,
+            before_save=new_transaction,
+        )
+        self.write(
+            {
+                "state": "done",
+                "date_end": fields.Datetime.now(),
+                "elapsed_time": time.time() - started,
+                "payslips_processed": self.payslip_count,
+                "attachment_id": attachment.id,
+            }
+        )
+        self.message_post(
+            body=_("The autoliquidacion file has been generated."),
+            partner_ids=self.user_id.partner_id.ids,
+            attachment_ids=attachment.ids,
+            message_type="comment",
+            subtype="mail.mt_comment",
+        )
+
+    @api.multi
+    def _fail(self, error):
+        self.write(
+            {"state": "failed", "date_end": fields.Datetime.now(), "error": error}
+        )
+        for job in self:
+            job.message_post(
+                body=_("The autoliquidacion file could not be generated."),
+                partner_ids=job.user_id.partner_id.ids,
+                message_type="comment",
+                subtype="mail.mt_comment",
+            )
+
+    @api.model
+    def _get_time_limit(self):
+        """ Number of seconds a scheduled action may run, 0 if unlimited. """
+        limit = config.get("limit_time_real_cron", -1)
+        if limit is None or limit < 0:
+            limit = config.get("limit_time_real") or 0
+        return limit
+
+    @api.model
+    def _recover_interrupted_jobs(self):
+        """ Queue again the running jobs started longer ago than the time limit
+        of a scheduled action: their worker was killed before it could end
+        them. The jobs already run JOB_MAX_ATTEMPTS times are failed. """
+        limit = self._get_time_limit()
+        if not limit:
+            return
+        started_before = fields.Datetime.now() - timedelta(seconds=limit)
+        jobs = self.search(
+            [("state", "=", "running"), ("date_start", "<", started_before)]
+        )
+        if not jobs:
+            return
+        _logger.warning("Autoliquidacion jobs %s were interrupted", jobs.ids)
+        exhausted = jobs.filtered(lambda job: job.attempts >= JOB_MAX_ATTEMPTS)
+        (jobs - exhausted).write({"state": "queued"})
+        exhausted._fail(
+            _(
+                "The job was interrupted %s times before it could end, the "
+                "time limit of the scheduled actions is too low for this file."
+            )
+            % JOB_MAX_ATTEMPTS
+        )
+        self.env.cr.commit()
+
+    @api.model
+    def _cron_process_jobs(self):
+        self._recover_interrupted_jobs()
+        for job in self.search([("state", "=", "queued")], order="id"):
+            try:
+                job._run()
+                self.env.cr.commit()
+            except Exception as e:
+                _logger.exception("Autoliquidacion job %s failed", job.id)
+                self.env.cr.rollback()
+                job.invalidate_cache()
+                self.env["hr.payslip"]._clear_line_lookups()
+                job._fail(tools.ustr(e))
+                self.env.cr.commit()
+
+    @api.multi
+    def action_refresh(self):
+        return True
+
+
+class AutoliquidacionLine(models.Model):
+    _name = "co_payroll.autoliquidacion_line"
+    _description = "Autoliquidacion Rendered Line"
+    _order = "payslip_id, sequence"
+
+    payslip_id = fields.Many2one(
+        "hr.payslip", required=True, index=True, ondelete="cascade"
+    )
+    leave_id = fields.Many2one("hr.leave", ondelete="cascade")
+    sequence = fields.Integer()
+    fingerprint = fields.Char(
+        required=True,
+        help="Digest of the data the line was rendered from. The line is "
+        "rendered again as soon as it doesn't match the data anymore.",
+    )
+    line = fields.Text(
+        help="Detail record, with sequence 0. Empty on the single row kept for "
+        "a payslip without any line, so it isn't rendered again either."
+    )
+    ibc_ccf = fields.Float()
+    subtotals = fields.Text(
+        help="Contributions of the line by administrator, as a JSON list of "
+        "[kind, administration code, amount]."
+    )
+
+    @api.model
+    def _get_cached_lines(self, fingerprints):
+        """ Return ``{payslip_id: lines}`` for the payslips whose cached lines
+        were rendered with the fingerprint given in ``{payslip_id: fingerprint}``.
+        ``lines`` are ``(leave_id, line, ibc_ccf, subtotals)`` as rendered by the
+        wizard.
+        """
+        if not fingerprints:
+            return {}
+        # read ibc_ccf back exactly as it was written, it adds up to the header
+        self.env.cr.execute("SET LOCAL extra_float_digits = 3")
+        cached = defaultdict(list)
+        stale = set()
+        records = self.search([("payslip_id", "in", list(fingerprints))])
+        for values in records.read(
+            ["payslip_id", "leave_id", "fingerprint", "line", "ibc_ccf", "subtotals"],
+            load=False,
+        ):
+            payslip_id = values["payslip_id"]
+            if values["fingerprint"] != fingerprints[payslip_id]:
+                stale.add(payslip_id)
+            if not values["line"]:
+                # the payslip has no line
+                cached.setdefault(payslip_id, [])
+                continue
+            subtotals = tuple(
+                ((kind, code), amount)
+                for kind, code, amount in json.loads(values["subtotals"] or "[]")
+            )
+            cached[payslip_id].append(
+                (
+                    values["leave_id"] or None,
+                    values["line"],
+                    values["ibc_ccf"],
+                    subtotals,
+                )
+            )
+        # the lines aren't needed anymore once they have been read
+        records.invalidate_cache(ids=records.ids)
+        return {
+            payslip_id: lines
+            for payslip_id, lines in cached.items()
+            if payslip_id not in stale
+        }
+
+    @api.model
+    def _store_lines(self, rendered):
+        """ Replace the cached lines of the payslips in ``rendered``, a list of
+        ``(payslip_id, fingerprint, lines)``. A payslip without lines gets a
+        single empty row. """
+        self.search([("payslip_id", "in", [r[0] for r in rendered])]).unlink()
+        self.create(
+            [
+                {"payslip_id": payslip_id, "sequence": 0, "fingerprint": fingerprint}
+                for payslip_id, fingerprint, lines in rendered
+                if not lines
+            ]
+            + [
+                {
+                    "payslip_id": payslip_id,
+                    "leave_id": leave_id,
+                    "sequence": sequence,
+                    "fingerprint": fingerprint,
+                    "line": line,
+                    "ibc_ccf": ibc_ccf,
+                    "subtotals": json.dumps(
+                        [[kind, code, amount] for (kind, code), amount in subtotals]
+                    ),
+                }
+                for payslip_id, fingerprint, lines in rendered
+                for sequence, (leave_id, line, ibc_ccf, subtotals) in enumerate(lines)
+            ]
+        )
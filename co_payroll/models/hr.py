@@ -1,7 +1,280 @@
 # coding: utf-8
 # Copyright (C) 2019 Odoo Inc
-from odoo import api, models, fields, _
-from odoo.exceptions import UserError
+import logging
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict, namedtuple
+from weakref import WeakKeyDictionary
+
+from psycopg2 import OperationalError
+from werkzeug.exceptions import HTTPException
+
+from odoo import api, models, fields, tools, _
+from odoo.exceptions import AccessDenied, RedirectWarning, UserError, except_orm
+from odoo.osv import expression
+from odoo.tools import split_every
+from odoo.tools.safe_eval import _BUILTINS, _SAFE_OPCODES, test_expr, unsafe_eval
+from odoo.tools.sql import column_exists, create_column
+
+try:
+    from odoo.tools.safe_eval import check_values
+except ImportError:
+    check_values = None
+
+_logger = logging.getLogger(__name__)
+
+# payslip line lookups, per transaction (keyed on the record cache)
+_LINE_LOOKUPS = WeakKeyDictionary()
+
+# accounting of a salary rule, as ids, before its partners are resolved for a
+# contract: the partners are given by the name of the contract field holding
+# them, False for the home address of the payslip's employee
+RuleAccountingTemplate = namedtuple(
+    "RuleAccountingTemplate",
+    [
+        "debit_account_id",
+        "credit_account_id",
+        "debit_partner_field",
+        "credit_partner_field",
+        "analytic_account_id",
+        "tax_line_id",
+        "debit_tax_ids",
+        "credit_tax_ids",
+    ],
+)
+
+# accounting of a salary rule for a contract, as ids. A partner of None stands
+# for the home address of the payslip's employee.
+RuleAccounting = namedtuple(
+    "RuleAccounting",
+    [
+        "debit_account_id",
+        "credit_account_id",
+        "debit_partner_id",
+        "credit_partner_id",
+        "analytic_account_id",
+        "tax_line_id",
+        "debit_tax_ids",
+        "credit_tax_ids",
+    ],
+)
+
+# codes of a city and of its state, as used in the PILA
+CityInfo = namedtuple(
+    "CityInfo", ["id", "code", "state_id", "state_code", "country_id"]
+)
+EMPTY_CITY_INFO = CityInfo(False, False, False, False, False)
+
+# CityInfo of the cities by id, ids of the cities by (state_id, code) and by
+# (state_id, normalized name), where a False state_id matches any state
+CityIndex = namedtuple("CityIndex", ["by_id", "by_code", "by_name"])
+
+# codes of the states by id, ids of the states by (country_id, code) and by
+# (country_id, normalized name), where a False country_id matches any country
+StateIndex = namedtuple("StateIndex", ["codes", "by_code", "by_name"])
+
+
+def normalize_name(name):
+    """ Lowercase ``name``, without accents nor repeated spaces. """
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(name.lower().split())
+
+
+# changing these fields makes the draft payslips concerned stale
+STALE_PAYSLIP_FIELDS = {
+    "employee_id",
+    "contract_id",
+    "struct_id",
+    "date_from",
+    "date_to",
+    "credit_note",
+}
+STALE_CONTRACT_FIELDS = {
+    "wage",
+    "struct_id",
+    "arl_type",
+    "quotient_type",
+    "quotient_subtype",
+    "mobility_benefit_amount",
+    "food_benefit_amount",
+    "date_start",
+    "date_end",
+}
+STALE_LEAVE_FIELDS = {
+    "employee_id",
+    "holiday_status_id",
+    "date_from",
+    "date_to",
+    "number_of_days",
+    "state",
+}
+
+# worked days lines of every contract besides WORK100, as (description, code)
+MISC_WORKED_DAYS_LINES = [
+    ("Vacaciones Automaticas", "VACAC"),
+    ("Vaca Dias No Habiles", "VACAH"),
+    ("Vacaciones", "VACAS"),
+    ("Vacaciones Pagadas", "VACAP"),
+    ("Incapacidades Asumidas", "INC_117"),
+    ("Incapacidades Asumidias dias ATEP", "INC_117_ATEP"),
+    ("Incapacidad Enfermedad General", "INC_123"),
+    ("Incapacidad Enf Hos", "INC_123H"),
+    ("Incapacidad Accidente de Trabajo", "INC_125"),
+    ("Incapacidad Enfermedad Profesional", "INC_127"),
+    ("Incapacidad Por Maternidad / Paternidad", "INC_129"),
+    ("Prorroga Incapacidad", "INC_130"),
+    ("Prórroga Incapacidad Accidente de Trabajo", "INC_130P"),
+    ("Sanciones Laboral", "SLN_209"),
+    ("Permiso No Remunerado", "SLN_217"),
+    ("Liquidacion Cesantias", "L_CESANT"),
+    ("Liquidacion Interes De Cesantias", "L_INT_CESANT"),
+    ("Liquidacion Prima", "L_PRIMA"),
+    ("Liquidacion Vacaciones", "LVACA"),
+    ("Dias de Indemnizacion", "INDEM"),
+    ("Hora Extra Diurna Ordinaria", "H_102"),
+    ("Hora Extra Nocturna Ordinaria", "H_103"),
+    ("Hora Extra Diurna Festiva", "H_104"),
+    ("Hora Extra Festiva Nocturna", "H_105"),
+    ("Dominicales y Festivos", "H_106"),
+    ("Recargo Nocturno", "H_107"),
+    ("Descanso en Dinero", "H_108"),
+    ("Hora Extra Diurna Festiva Salario Variable", "H_120"),
+    ("Hora Extra Nocturna Festiva Salario Variable", "H_121"),
+    ("Dominicales y Festivos Reforma 2003", "H_141"),
+    ("Licencia Remunerada", "I_152"),
+    ("Ausencias Laborales", "I_206"),
+    ("Sanciones Laborales", "I_209"),
+    ("Ajuste de dias VAC mes siguiente (Autoliquidacion)", "AUT_VACA_MS"),
+    ("Ajuste de dias VAC mes anterior (Autoliquidacon)", "AUT_VACA_MA"),
+]
+
+
+# compiled code of the salary rules, {(rule_id, mode, hash): (source, code)},
+# kept for the lifetime of the worker
+_RULE_CODE = {}
+
+# evaluations of the salary rules in this worker, {rule_id: [count, time]}
+_RULE_STATS = defaultdict(lambda: [0, 0.0])
+
+# accounting tables of the structures in this worker,
+# {(dbname, struct_id): (stamp, {rule_id: RuleAccountingTemplate})}
+_ACCOUNTING_TABLES = {}
+
+
+# exceptions safe_eval lets through as they are, the others are wrapped in a
+# ValueError quoting the code
+_EVAL_PASSTHROUGH = (
+    except_orm,
+    RedirectWarning,
+    AccessDenied,
+    HTTPException,
+    OperationalError,
+    ZeroDivisionError,
+)
+
+
+def _eval_rule_code(rule_id, source, localdict, mode="eval", nocopy=False):
+    """ Same as safe_eval, test_expr checking and compiling the code only once
+    per rule and source. """
+    key = (rule_id, mode, hash(source))
+    compiled = _RULE_CODE.get(key)
+    if compiled is None or compiled[0] != source:
+        compiled = _RULE_CODE[key] = (
+            source,
+            test_expr(source, _SAFE_OPCODES, mode=mode),
+        )
+    globals_dict = localdict if nocopy else dict(localdict)
+    if check_values:
+        check_values(globals_dict)
+    globals_dict["__builtins__"] = _BUILTINS
+    try:
+        return unsafe_eval(compiled[1], globals_dict)
+    except _EVAL_PASSTHROUGH:
+        raise
+    except Exception as e:
+        raise ValueError(
+            '%s: "%s" while evaluating\n%r'
+            % (tools.ustr(type(e)), tools.ustr(e), source)
+        ) from e
+
+
+# rows inserted by a single INSERT query
+INSERT_BATCH = 1000
+
+
+def _insert_rows(cr, table, columns, rows):
+    """ Insert ``rows`` (tuples of values of ``columns``) in ``table``. """
+    for batch in split_every(INSERT_BATCH, rows):
+        cr.execute(
+            "INSERT INTO %s (%s) VALUES %s"
+            % (table, ", ".join(columns), ", ".join(["%s"] * len(batch))),
+            batch,
+        )
+
+
+class PayslipLineLookup(object):
+    """ Read-only view of the lines and worked days of a payslip.
+
+    Values are indexed by line code, category code and worked days code so
+    that reports and accounting don't have to scan ``line_ids`` for every
+    value they need. Sums are done in line order to give exactly the same
+    result as summing the filtered lines.
+    """
+
+    def __init__(self, payslip):
+        self._codes = set()
+        self._totals = {}
+        self._amounts = {}
+        self._rates = defaultdict(list)
+        self._category_totals = defaultdict(list)
+        self._days = defaultdict(list)
+        self._hours = defaultdict(list)
+
+        for position, line in enumerate(payslip.line_ids):
+            self._codes.add(line.code)
+            self._totals.setdefault(line.code, line.total)
+            self._amounts.setdefault(line.code, line.amount)
+            self._rates[line.code].append((position, line.rate / 100.0))
+            self._category_totals[line.category_id.code].append(
+                (position, line.total)
+            )
+
+        for position, line in enumerate(payslip.worked_days_line_ids):
+            self._days[line.code].append((position, line.number_of_days))
+            self._hours[line.code].append((position, line.number_of_hours))
+
+    def _sum(self, values_by_key, keys):
+        if not isinstance(keys, (list, tuple)):
+            keys = (keys,)
+        values = []
+        for key in keys:
+            values += values_by_key.get(key, [])
+        return sum(value for position, value in sorted(values))
+
+    def has_code(self, code):
+        return code in self._codes
+
+    def total(self, code):
+        """ Total of the first line with ``code``, 0 if there is none. """
+        return self._totals.get(code, 0)
+
+    def amount(self, code):
+        """ Amount of the first line with ``code``, 0 if there is none. """
+        return self._amounts.get(code, 0.0)
+
+    def rate(self, codes):
+        """ Sum of the rates (as a fraction) of the lines with ``codes``. """
+        return self._sum(self._rates, codes)
+
+    def category_total(self, category_codes):
+        return self._sum(self._category_totals, category_codes)
+
+    def worked_days(self, codes):
+        return self._sum(self._days, codes)
+
+    def worked_hours(self, codes):
+        return self._sum(self._hours, codes)
 
 
 class HrEmployee(models.Model):
@@ -27,6 +300,28 @@ class HrPayslipWorkedDays(models.Model):
         related="payslip_id.contract_id", store=True, readonly=False
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(HrPayslipWorkedDays, self).create(vals_list)
+        res.mapped("payslip_id")._invalidate_line_lookup()
+        res.mapped("payslip_id")._mark_stale()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        self.mapped("payslip_id")._invalidate_line_lookup()
+        self.mapped("payslip_id")._mark_stale()
+        res = super(HrPayslipWorkedDays, self).write(vals)
+        self.mapped("payslip_id")._invalidate_line_lookup()
+        self.mapped("payslip_id")._mark_stale()
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.mapped("payslip_id")._invalidate_line_lookup()
+        self.mapped("payslip_id")._mark_stale()
+        return super(HrPayslipWorkedDays, self).unlink()
+
 
 class HrPayslipInput(models.Model):
     _inherit = "hr.payslip.input"
@@ -34,6 +329,24 @@ class HrPayslipInput(models.Model):
     employee_id = fields.Many2one(related="payslip_id.employee_id", store=True)
     payslip_date_from = fields.Date(related="payslip_id.date_from", store=True)
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(HrPayslipInput, self).create(vals_list)
+        res.mapped("payslip_id")._mark_stale()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        self.mapped("payslip_id")._mark_stale()
+        res = super(HrPayslipInput, self).write(vals)
+        self.mapped("payslip_id")._mark_stale()
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.mapped("payslip_id")._mark_stale()
+        return super(HrPayslipInput, self).unlink()
+
 
 class HrPayslipLine(models.Model):
     _inherit = "hr.payslip.line"
@@ -41,6 +354,24 @@ class HrPayslipLine(models.Model):
     payslip_date_from = fields.Date(related="slip_id.date_from", store=True)
     payslip_state = fields.Selection(related="slip_id.state", store=True, readonly=True)
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(HrPayslipLine, self).create(vals_list)
+        res.mapped("slip_id")._invalidate_line_lookup()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        self.mapped("slip_id")._invalidate_line_lookup()
+        res = super(HrPayslipLine, self).write(vals)
+        self.mapped("slip_id")._invalidate_line_lookup()
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.mapped("slip_id")._invalidate_line_lookup()
+        return super(HrPayslipLine, self).unlink()
+
 
 class HrPayslip(models.Model):
     _inherit = "hr.payslip"
@@ -48,6 +379,319 @@ class HrPayslip(models.Model):
     line_ids = fields.One2many(
         domain=[("salary_rule_id.appears_on_payslip", "=", True)]
     )
+    is_stale = fields.Boolean(
+        string="Por Recalcular",
+        default=True,
+        readonly=True,
+        copy=False,
+        index=True,
+        help="The inputs, worked days, contract or leaves of the payslip changed "
+        "since it was last computed.",
+    )
+    worked_days_catalog = fields.Html(
+        string="Catálogo de Días Trabajados",
+        compute="_compute_worked_days_catalog",
+        help="In sparse mode, every worked days code of the contract, the ones "
+        "that aren't stored shown at zero.",
+    )
+
+    @api.multi
+    def _get_worked_days_catalog(self):
+        """ Return the worked days of the payslip in the catalog of
+        get_worked_day_lines, as dicts of values: the codes that aren't stored
+        at zero, the stored lines with ``line_id``, the ones outside the
+        catalog last. """
+        self.ensure_one()
+        stored = {line.code: line for line in self.worked_days_line_ids}
+        catalog = []
+        for vals in self.get_worked_day_lines(self.contract_id, None, None):
+            line = stored.pop(vals["code"], None)
+            catalog.append(
+                dict(
+                    vals,
+                    name=line.name if line else vals["name"],
+                    number_of_days=line.number_of_days if line else 0.0,
+                    number_of_hours=line.number_of_hours if line else 0.0,
+                    line_id=line.id if line else False,
+                )
+            )
+        for code, line in stored.items():
+            catalog.append(
+                {
+                    "name": line.name,
+                    "code": code,
+                    "sequence": line.sequence,
+                    "number_of_days": line.number_of_days,
+                    "number_of_hours": line.number_of_hours,
+                    "contract_id": line.contract_id.id,
+                    "line_id": line.id,
+                }
+            )
+        return catalog
+
+    @api.depends(
+        "contract_id",
+        "company_id.sparse_worked_days",
+        "worked_days_line_ids.code",
+        "worked_days_line_ids.number_of_days",
+        "worked_days_line_ids.number_of_hours",
+    )
+    def _compute_worked_days_catalog(self):
+        """ Render the catalog with the worked_days_catalog template. """
+        for slip in self:
+            if not slip.company_id.sparse_worked_days:
+                slip.worked_days_catalog = False
+                continue
+            slip.worked_days_catalog = tools.ustr(
+                self.env["ir.qweb"].render(
+                    "co_payroll.worked_days_catalog",
+                    {"catalog": slip._get_worked_days_catalog()},
+                )
+            )
+
+    @api.multi
+    def action_edit_worked_days_catalog(self):
+        """ Open the catalog of worked days of the payslip to enter the days of
+        any of its codes. """
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Catálogo de Días Trabajados"),
+            "res_model": "co_payroll.worked_days_catalog",
+            "view_mode": "form",
+            "target": "new",
+            "context": {"default_payslip_id": self.id},
+        }
+
+    @api.multi
+    def _get_line_lookup(self):
+        """ Return the (cached) PayslipLineLookup of this payslip. """
+        self.ensure_one()
+        lookups = _LINE_LOOKUPS.setdefault(self.env.cache, {})
+        if self.id not in lookups:
+            lookups[self.id] = PayslipLineLookup(self)
+        return lookups[self.id]
+
+    @api.model_cr_context
+    def _auto_init(self):
+        # when is_stale is added, only the draft payslips are still to compute:
+        # the column is created and filled here, not with the default
+        if not column_exists(self.env.cr, self._table, "is_stale"):
+            create_column(self.env.cr, self._table, "is_stale", "boolean")
+            self.env.cr.execute(
+                "UPDATE %s SET is_stale = (state = 'draft')" % self._table
+            )
+        return super(HrPayslip, self)._auto_init()
+
+    @api.model
+    def _drop_zero_worked_days(self, vals, company):
+        """ In sparse mode, remove the worked days lines without days nor
+        hours from the commands of ``vals``. Missing codes are read as zero. """
+        commands = vals.get("worked_days_line_ids")
+        if not commands or not company.sparse_worked_days:
+            return vals
+        return dict(
+            vals,
+            worked_days_line_ids=[
+                command
+                for command in commands
+                if command[0] != 0
+                or command[2].get("number_of_days")
+                or command[2].get("number_of_hours")
+            ],
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        default_company = self.env.user.company_id
+        vals_list = [
+            self._drop_zero_worked_days(
+                vals,
+                self.env["res.company"].browse(vals["company_id"])
+                if vals.get("company_id")
+                else default_company,
+            )
+            for vals in vals_list
+        ]
+        if not self.env.context.get("bulk_payslip_lines"):
+            return super(HrPayslip, self).create(vals_list)
+
+        # create the worked days and input lines with multi-row inserts
+        line_values = []
+        for index, vals in enumerate(vals_list):
+            vals = vals_list[index] = dict(vals)
+            lines = []
+            for field_name in ("worked_days_line_ids", "input_line_ids"):
+                commands = vals.get(field_name) or []
+                if all(command[0] == 0 for command in commands):
+                    lines.append([command[2] for command in vals.pop(field_name, [])])
+                else:
+                    lines.append([])
+            line_values.append(lines)
+        payslips = super(HrPayslip, self).create(vals_list)
+        payslips._insert_lines(line_values)
+        return payslips
+
+    @api.multi
+    def _insert_lines(self, line_values):
+        """ Insert the worked days and input lines of the payslips, including
+        their stored related fields, with multi-row INSERTs.
+
+        :param line_values: ``[worked_days_values, input_values]`` for every
+            payslip of ``self``, as lists of dictionaries of values
+        """
+        now = fields.Datetime.now()
+        uid = self.env.uid
+        worked_days_rows = []
+        input_rows = []
+        for slip, (worked_days_values, input_values) in zip(self, line_values):
+            for vals in worked_days_values:
+                worked_days_rows.append(
+                    (
+                        vals["name"],
+                        vals["code"],
+                        vals.get("sequence", 10),
+                        vals.get("number_of_days") or 0.0,
+                        vals.get("number_of_hours") or 0.0,
+                        slip.id,
+                        slip.contract_id.id,
+                        slip.date_from,
+                        slip.state,
+                        uid,
+                        now,
+                        uid,
+                        now,
+                    )
+                )
+            for vals in input_values:
+                input_rows.append(
+                    (
+                        vals["name"],
+                        vals["code"],
+                        vals.get("sequence", 10),
+                        vals.get("amount") or 0.0,
+                        slip.id,
+                        vals.get("contract_id") or slip.contract_id.id,
+                        slip.employee_id.id,
+                        slip.date_from,
+                        uid,
+                        now,
+                        uid,
+                        now,
+                    )
+                )
+
+        _insert_rows(
+            self.env.cr,
+            self.env["hr.payslip.worked_days"]._table,
+            [
+                "name",
+                "code",
+                "sequence",
+                "number_of_days",
+                "number_of_hours",
+                "payslip_id",
+                "contract_id",
+                "payslip_date_from",
+                "payslip_state",
+                "create_uid",
+                "create_date",
+                "write_uid",
+                "write_date",
+            ],
+            worked_days_rows,
+        )
+        _insert_rows(
+            self.env.cr,
+            self.env["hr.payslip.input"]._table,
+            [
+                "name",
+                "code",
+                "sequence",
+                "amount",
+                "payslip_id",
+                "contract_id",
+                "employee_id",
+                "payslip_date_from",
+                "create_uid",
+                "create_date",
+                "write_uid",
+                "write_date",
+            ],
+            input_rows,
+        )
+        self.invalidate_cache(["worked_days_line_ids", "input_line_ids"], self.ids)
+        self._invalidate_line_lookup()
+
+    @api.multi
+    def write(self, vals):
+        mark_stale = STALE_PAYSLIP_FIELDS.intersection(vals) and "is_stale" not in vals
+        if "worked_days_line_ids" not in vals:
+            res = super(HrPayslip, self).write(vals)
+        else:
+            for slip in self:
+                company = slip.company_id or self.env.user.company_id
+                super(HrPayslip, slip).write(
+                    self._drop_zero_worked_days(vals, company)
+                )
+            res = True
+        if mark_stale:
+            self._mark_stale()
+        return res
+
+    @api.model
+    def _get_payslip_lines(self, contract_ids, payslip_id):
+        """ In sparse mode, rules are computed with a zero worked days line for
+        every code of the catalog that isn't stored, so that rules reading
+        e.g. ``worked_days.VACAC.number_of_days`` keep working. """
+        payslip = self.browse(payslip_id)
+        if not payslip.company_id.sparse_worked_days:
+            return super(HrPayslip, self)._get_payslip_lines(contract_ids, payslip_id)
+
+        WorkedDays = self.env["hr.payslip.worked_days"]
+        stored = payslip.worked_days_line_ids
+        codes = set(stored.mapped("code"))
+        virtual = WorkedDays
+        for contract in self.env["hr.contract"].browse(contract_ids):
+            for vals in self.get_worked_day_lines(contract, None, None):
+                if vals["code"] not in codes:
+                    codes.add(vals["code"])
+                    vals.update(number_of_days=0, number_of_hours=0)
+                    virtual |= WorkedDays.new(dict(vals, payslip_id=payslip.id))
+
+        field = self._fields["worked_days_line_ids"]
+        self.env.cache.set(payslip, field, tuple(stored.ids + virtual.ids))
+        try:
+            return super(HrPayslip, self)._get_payslip_lines(contract_ids, payslip_id)
+        finally:
+            payslip.invalidate_cache(["worked_days_line_ids"], payslip.ids)
+            payslip._invalidate_line_lookup()
+
+    @api.multi
+    def _mark_stale(self):
+        """ Flag the payslips to be computed again. """
+        self.filtered(
+            lambda slip: slip.state in ("draft", "verify") and not slip.is_stale
+        ).write({"is_stale": True})
+
+    @api.multi
+    def compute_sheet(self):
+        res = super(HrPayslip, self).compute_sheet()
+        self.write({"is_stale": False})
+        return res
+
+    @api.multi
+    def _invalidate_line_lookup(self):
+        lookups = _LINE_LOOKUPS.get(self.env.cache)
+        if lookups:
+            for payslip_id in self.ids:
+                lookups.pop(payslip_id, None)
+
+    @api.model
+    def _clear_line_lookups(self):
+        """ Drop all the line lookups of the transaction, e.g. after a
+        rollback. """
+        _LINE_LOOKUPS.pop(self.env.cache, None)
 
     def _create_worked_day_line(self, name, code, days, hours, contract_id):
         return {
@@ -65,44 +709,6 @@ class HrPayslip(models.Model):
 
     @api.model
     def get_worked_day_lines(self, contract_ids, date_from, date_to, context=None):
-        # description, code
-        MISC_WORKED_DAYS_LINES = [
-            ("Vacaciones Automaticas", "VACAC"),
-            ("Vaca Dias No Habiles", "VACAH"),
-            ("Vacaciones", "VACAS"),
-            ("Vacaciones Pagadas", "VACAP"),
-            ("Incapacidades Asumidas", "INC_117"),
-            ("Incapacidades Asumidias dias ATEP", "INC_117_ATEP"),
-            ("Incapacidad Enfermedad General", "INC_123"),
-            ("Incapacidad Enf Hos", "INC_123H"),
-            ("Incapacidad Accidente de Trabajo", "INC_125"),
-            ("Incapacidad Enfermedad Profesional", "INC_127"),
-            ("Incapacidad Por Maternidad / Paternidad", "INC_129"),
-            ("Prorroga Incapacidad", "INC_130"),
-            ("Prórroga Incapacidad Accidente de Trabajo", "INC_130P"),
-            ("Sanciones Laboral", "SLN_209"),
-            ("Permiso No Remunerado", "SLN_217"),
-            ("Liquidacion Cesantias", "L_CESANT"),
-            ("Liquidacion Interes De Cesantias", "L_INT_CESANT"),
-            ("Liquidacion Prima", "L_PRIMA"),
-            ("Liquidacion Vacaciones", "LVACA"),
-            ("Dias de Indemnizacion", "INDEM"),
-            ("Hora Extra Diurna Ordinaria", "H_102"),
-            ("Hora Extra Nocturna Ordinaria", "H_103"),
-            ("Hora Extra Diurna Festiva", "H_104"),
-            ("Hora Extra Festiva Nocturna", "H_105"),
-            ("Dominicales y Festivos", "H_106"),
-            ("Recargo Nocturno", "H_107"),
-            ("Descanso en Dinero", "H_108"),
-            ("Hora Extra Diurna Festiva Salario Variable", "H_120"),
-            ("Hora Extra Nocturna Festiva Salario Variable", "H_121"),
-            ("Dominicales y Festivos Reforma 2003", "H_141"),
-            ("Licencia Remunerada", "I_152"),
-            ("Ausencias Laborales", "I_206"),
-            ("Sanciones Laborales", "I_209"),
-            ("Ajuste de dias VAC mes siguiente (Autoliquidacion)", "AUT_VACA_MS"),
-            ("Ajuste de dias VAC mes anterior (Autoliquidacon)", "AUT_VACA_MA"),
-        ]
         res = []
 
         for contract in contract_ids:
@@ -121,196 +727,275 @@ class HrPayslip(models.Model):
                     self._create_worked_day_line(line[0], line[1], 0, 0, contract_id)
                 )
 
-            # keep order as defined here. hr.payslip.worked_days is ordered on 'payslip_id, sequence'
-            for index, line in enumerate(res):
-                line["sequence"] = index
+        # keep order as defined here. hr.payslip.worked_days is ordered on 'payslip_id, sequence'
+        for index, line in enumerate(res):
+            line["sequence"] = index
 
         return res
 
     @api.multi
     def _create_payment_for_payslip(self):
+        """ Create the payments of the payslips, one per payslip. """
+        check_method = self.env.ref(
+            "account_check_printing.account_payment_method_check"
+        )
+        manual_method = self.env.ref("account.account_payment_method_manual_out")
+        journal = self.env.user.company_id.payment_journal_id
+
+        vals_list = []
         for payslip in self:
-            payment_method_id = self.env.ref(
-                "account_check_printing.account_payment_method_check"
-            )
-            if payslip.employee_id.bank_account_id:
-                payment_method_id = self.env.ref(
-                    "account.account_payment_method_manual_out"
+            lookup = payslip._get_line_lookup()
+            if not lookup.has_code("NET"):
+                raise UserError(
+                    _("Payslip %s has no NET line to pay.") % payslip.display_name
                 )
-
-            self.env["account.payment"].create(
+            partner = payslip.employee_id.address_home_id
+            vals_list.append(
                 {
                     "payment_type": "outbound",
                     "partner_type": "supplier",
-                    "partner_id": payslip.employee_id.address_home_id.id,
-                    "force_account_id": payslip.employee_id.address_home_id.property_account_payable_id.id,
-                    "journal_id": self.env.user.company_id.payment_journal_id.id,
-                    "payment_method_id": payment_method_id.id,
+                    "partner_id": partner.id,
+                    "force_account_id": partner.property_account_payable_id.id,
+                    "journal_id": journal.id,
+                    "payment_method_id": manual_method.id
+                    if payslip.employee_id.bank_account_id
+                    else check_method.id,
                     "communication": payslip.number,
                     "currency_id": payslip.journal_id.currency_id.id
-                    or self.company_id.currency_id.id,
-                    "amount": payslip.line_ids.filtered(
-                        lambda line: line.code == "NET"
-                    )[0].amount,
+                    or payslip.company_id.currency_id.id,
+                    "amount": lookup.amount("NET"),
                     "payslip_id": payslip.id,
                 }
             )
+        return self.env["account.payment"].create(vals_list)
 
     @api.multi
-    def action_payslip_done(self):
-        for slip in self:
-            line_ids = []
-            debit_sum = 0.0
-            credit_sum = 0.0
-            date = slip.date or slip.date_to
-            currency = slip.company_id.currency_id
-
-            name = _("Payslip of %s") % (slip.employee_id.name)
-            move_dict = {
-                "narration": name,
-                "ref": slip.number,
-                "journal_id": slip.journal_id.id,
-                "date": date,
-            }
-            for line in slip.details_by_salary_rule_category:
-                amount = currency.round(slip.credit_note and -line.total or line.total)
-                if currency.is_zero(amount):
-                    continue
-
-                debit_account_id = line.salary_rule_id.account_debit
-                credit_account_id = line.salary_rule_id.account_credit
-
-                debit_accounting_partner = slip.employee_id.address_home_id.id
-                credit_accounting_partner = slip.employee_id.address_home_id.id
-                if line.salary_rule_id.debit_accounting_partner:
-                    debit_accounting_partner = line.contract_id[
-                        line.salary_rule_id.debit_accounting_partner
-                    ]
-                    debit_accounting_partner = (
-                        debit_accounting_partner.commercial_partner_id.id
-                        if debit_accounting_partner
-                        else False
-                    )
-                if line.salary_rule_id.credit_accounting_partner:
-                    credit_accounting_partner = line.contract_id[
-                        line.salary_rule_id.credit_accounting_partner
-                    ]
-                    credit_accounting_partner = (
-                        credit_accounting_partner.commercial_partner_id.id
-                        if credit_accounting_partner
-                        else False
-                    )
-
-                include_taxes = any(
-                    slip.line_ids.filtered(lambda line: line.code == "IMP_RTEFUENTE")
-                )
-
-                if debit_account_id:
-                    debit_line = (
-                        0,
-                        0,
-                        {
-                            "name": line.name,
-                            "partner_id": debit_accounting_partner,
-                            "account_id": debit_account_id.id,
-                            "journal_id": slip.journal_id.id,
-                            "date": date,
-                            "debit": amount > 0.0 and amount or 0.0,
-                            "credit": amount < 0.0 and -amount or 0.0,
-                            "analytic_account_id": line.salary_rule_id.analytic_account_id.id,
-                            "tax_ids": [(6, 0, debit_account_id.tax_ids.ids)]
-                            if include_taxes
-                            else [],
-                        },
-                    )
-
-                    if include_taxes:
-                        debit_line[2]["tax_line_id"] = (
-                            line.salary_rule_id.account_tax_id
-                            and line.salary_rule_id.account_tax_id.id
-                            or False
-                        )
-
-                    line_ids.append(debit_line)
-                    debit_sum += debit_line[2]["debit"] - debit_line[2]["credit"]
-
-                if credit_account_id:
-                    credit_line = (
-                        0,
-                        0,
-                        {
-                            "name": line.name,
-                            "partner_id": credit_accounting_partner,
-                            "account_id": credit_account_id.id,
-                            "journal_id": slip.journal_id.id,
-                            "date": date,
-                            "debit": amount < 0.0 and -amount or 0.0,
-                            "credit": amount > 0.0 and amount or 0.0,
-                            "analytic_account_id": line.salary_rule_id.analytic_account_id.id,
-                            "tax_ids": [(6, 0, credit_account_id.tax_ids.ids)]
-                            if include_taxes
-                            else [],
-                        },
-                    )
-                    line_ids.append(credit_line)
-                    credit_sum += credit_line[2]["credit"] - credit_line[2]["debit"]
+    def _prepare_move_values(self):
+        """ Return the values of the journal entry of the payslip. """
+        self.ensure_one()
+        line_ids = []
+        debit_sum = 0.0
+        credit_sum = 0.0
+        date = self.date or self.date_to
+        currency = self.company_id.currency_id
+
+        name = _("Payslip of %s") % (self.employee_id.name)
+        move_dict = {
+            "narration": name,
+            "ref": self.number,
+            "journal_id": self.journal_id.id,
+            "date": date,
+        }
+        include_taxes = self._get_line_lookup().has_code("IMP_RTEFUENTE")
+        SalaryRule = self.env["hr.salary.rule"]
+        table = SalaryRule._get_accounting_table(self.struct_id.id)
+        partners = {}
+        employee_partner_id = self.employee_id.address_home_id.id
+        for line in self.details_by_salary_rule_category:
+            amount = currency.round(self.credit_note and -line.total or line.total)
+            if currency.is_zero(amount):
+                continue
+
+            rule = line.salary_rule_id
+            template = table.get(rule.id) or rule._get_accounting_template()
+            accounting = SalaryRule._resolve_accounting(
+                template, line.contract_id, partners
+            )
 
-            # generate account.payments
-            self._create_payment_for_payslip()
+            debit_accounting_partner = accounting.debit_partner_id
+            if debit_accounting_partner is None:
+                debit_accounting_partner = employee_partner_id
+            credit_accounting_partner = accounting.credit_partner_id
+            if credit_accounting_partner is None:
+                credit_accounting_partner = employee_partner_id
 
-            if currency.compare_amounts(credit_sum, debit_sum) == -1:
-                acc_id = slip.journal_id.default_credit_account_id.id
-                if not acc_id:
-                    raise UserError(
-                        _(
-                            'The Expense Journal "%s" has not properly configured the Credit Account!'
-                        )
-                        % (slip.journal_id.name)
-                    )
-                adjust_credit = (
+            if accounting.debit_account_id:
+                debit_line = (
                     0,
                     0,
                     {
-                        "name": _("Adjustment Entry"),
-                        "partner_id": False,
-                        "account_id": acc_id,
-                        "journal_id": slip.journal_id.id,
+                        "name": line.name,
+                        "partner_id": debit_accounting_partner,
+                        "account_id": accounting.debit_account_id,
+                        "journal_id": self.journal_id.id,
                         "date": date,
-                        "debit": 0.0,
-                        "credit": currency.round(debit_sum - credit_sum),
+                        "debit": amount > 0.0 and amount or 0.0,
+                        "credit": amount < 0.0 and -amount or 0.0,
+                        "analytic_account_id": accounting.analytic_account_id,
+                        "tax_ids": [(6, 0, list(accounting.debit_tax_ids))]
+                        if include_taxes
+                        else [],
                     },
                 )
-                line_ids.append(adjust_credit)
 
-            elif currency.compare_amounts(debit_sum, credit_sum) == -1:
-                acc_id = slip.journal_id.default_debit_account_id.id
-                if not acc_id:
-                    raise UserError(
-                        _(
-                            'The Expense Journal "%s" has not properly configured the Debit Account!'
-                        )
-                        % (slip.journal_id.name)
-                    )
-                adjust_debit = (
+                if include_taxes:
+                    debit_line[2]["tax_line_id"] = accounting.tax_line_id
+
+                line_ids.append(debit_line)
+                debit_sum += debit_line[2]["debit"] - debit_line[2]["credit"]
+
+            if accounting.credit_account_id:
+                credit_line = (
                     0,
                     0,
                     {
-                        "name": _("Adjustment Entry"),
-                        "partner_id": False,
-                        "account_id": acc_id,
-                        "journal_id": slip.journal_id.id,
+                        "name": line.name,
+                        "partner_id": credit_accounting_partner,
+                        "account_id": accounting.credit_account_id,
+                        "journal_id": self.journal_id.id,
                         "date": date,
-                        "debit": currency.round(credit_sum - debit_sum),
-                        "credit": 0.0,
+                        "debit": amount < 0.0 and -amount or 0.0,
+                        "credit": amount > 0.0 and amount or 0.0,
+                        "analytic_account_id": accounting.analytic_account_id,
+                        "tax_ids": [(6, 0, list(accounting.credit_tax_ids))]
+                        if include_taxes
+                        else [],
                     },
                 )
-                line_ids.append(adjust_debit)
-            move_dict["line_ids"] = line_ids
-            move = self.env["account.move"].create(move_dict)
-            slip.write({"move_id": move.id, "date": date})
-            move.post()
+                line_ids.append(credit_line)
+                credit_sum += credit_line[2]["credit"] - credit_line[2]["debit"]
+
+        if currency.compare_amounts(credit_sum, debit_sum) == -1:
+            acc_id = self.journal_id.default_credit_account_id.id
+            if not acc_id:
+                raise UserError(
+                    _(
+                        'The Expense Journal "%s" has not properly configured the Credit Account! (payslip %s)'
+                    )
+                    % (self.journal_id.name, self.display_name)
+                )
+            adjust_credit = (
+                0,
+                0,
+                {
+                    "name": _("Adjustment Entry"),
+                    "partner_id": False,
+                    "account_id": acc_id,
+                    "journal_id": self.journal_id.id,
+                    "date": date,
+                    "debit": 0.0,
+                    "credit": currency.round(debit_sum - credit_sum),
+                },
+            )
+            line_ids.append(adjust_credit)
+
+        elif currency.compare_amounts(debit_sum, credit_sum) == -1:
+            acc_id = self.journal_id.default_debit_account_id.id
+            if not acc_id:
+                raise UserError(
+                    _(
+                        'The Expense Journal "%s" has not properly configured the Debit Account! (payslip %s)'
+                    )
+                    % (self.journal_id.name, self.display_name)
+                )
+            adjust_debit = (
+                0,
+                0,
+                {
+                    "name": _("Adjustment Entry"),
+                    "partner_id": False,
+                    "account_id": acc_id,
+                    "journal_id": self.journal_id.id,
+                    "date": date,
+                    "debit": currency.round(credit_sum - debit_sum),
+                    "credit": 0.0,
+                },
+            )
+            line_ids.append(adjust_debit)
+        if self.company_id.payslip_move_grouping in ("slip", "run"):
+            line_ids = self._summarize_move_lines(line_ids, currency)
+        move_dict["line_ids"] = line_ids
+
+        debit = sum(line[2]["debit"] for line in line_ids)
+        credit = sum(line[2]["credit"] for line in line_ids)
+        if currency.compare_amounts(debit, credit) != 0:
+            raise UserError(
+                _("The journal entry of payslip %s is not balanced.")
+                % self.display_name
+            )
+        return move_dict
+
+    @api.model
+    def _summarize_move_lines(self, line_ids, currency):
+        """ Merge the journal items (given as creation commands) that share
+        account, partner, analytic account and taxes in a single item. """
+        summary = OrderedDict()
+        for command in line_ids:
+            vals = command[2]
+            tax_ids = vals.get("tax_ids") and vals["tax_ids"][0][2] or []
+            key = (
+                vals["account_id"],
+                vals["partner_id"],
+                vals.get("analytic_account_id") or False,
+                tuple(sorted(tax_ids)),
+                vals.get("tax_line_id") or False,
+            )
+            if key not in summary:
+                summary[key] = dict(vals, debit=0.0, credit=0.0, balance=0.0)
+            item = summary[key]
+            item["balance"] += vals["debit"] - vals["credit"]
+            if item["name"] != vals["name"]:
+                item["name"] = self.env["account.account"].browse(key[0]).name
+
+        summarized = []
+        for item in summary.values():
+            balance = currency.round(item.pop("balance"))
+            if currency.is_zero(balance):
+                continue
+            item["debit"] = balance if balance > 0.0 else 0.0
+            item["credit"] = -balance if balance < 0.0 else 0.0
+            summarized.append((0, 0, item))
+        return summarized
 
-        return self.write({"paid": True, "state": "done"})
+    @api.multi
+    def action_payslip_done(self):
+        # values of the journal entries to create and the slips of each one
+        move_vals_list = []
+        move_slips = []
+        run_moves = {}
+        for slip in self:
+            move_vals = slip._prepare_move_values()
+            run = slip.payslip_run_id
+            if slip.company_id.payslip_move_grouping != "run" or not run:
+                move_vals_list.append(move_vals)
+                move_slips.append(slip)
+                continue
+
+            key = (run.id, move_vals["journal_id"], move_vals["date"])
+            if key in run_moves:
+                index = run_moves[key]
+                move_vals_list[index]["line_ids"] += move_vals["line_ids"]
+                move_slips[index] |= slip
+            else:
+                run_moves[key] = len(move_vals_list)
+                move_vals["narration"] = _("Payslips of %s") % run.name
+                move_vals["ref"] = run.name
+                move_vals_list.append(move_vals)
+                move_slips.append(slip)
+
+        for index in run_moves.values():
+            move_vals_list[index]["line_ids"] = self._summarize_move_lines(
+                move_vals_list[index]["line_ids"],
+                move_slips[index].mapped("company_id.currency_id"),
+            )
+
+        # generate account.payments
+        self._create_payment_for_payslip()
+
+        moves = self.env["account.move"].create(move_vals_list)
+        moves.post()
+
+        # link the payslips of every move to it, a single write in run mode
+        for slips, move, vals in zip(move_slips, moves, move_vals_list):
+            slips.write(
+                {
+                    "move_id": move.id,
+                    "date": vals["date"],
+                    "paid": True,
+                    "state": "done",
+                }
+            )
+        return True
 
 
 class HrContract(models.Model):
@@ -389,26 +1074,34 @@ class HrContract(models.Model):
         string="Sub Tipo de Cotizante",
     )
 
+    @api.multi
+    def write(self, vals):
+        if STALE_CONTRACT_FIELDS.intersection(vals):
+            self.env["hr.payslip"].search(
+                [("contract_id", "in", self.ids), ("state", "in", ("draft", "verify"))]
+            )._mark_stale()
+        return super(HrContract, self).write(vals)
+
 
 class HrSalaryRule(models.Model):
     _inherit = "hr.salary.rule"
 
-    def _get_accounting_partner_values(self):
-        Fields = self.env["ir.model.fields"]
-        # do this because Odoo doesn't always delete ir.model.fields
-        loaded_hr_contract_fields = list(self.env["hr.contract"]._fields.keys())
-        contract_accounting_partner_fields = Fields.search(
-            [
-                ("model", "=", "hr.contract"),
-                ("name", "like", "_accounting_partner_id"),
-                ("name", "in", loaded_hr_contract_fields),
-            ],
-            order="field_description",
-        )
-        return [
-            (field.name, field.field_description)
-            for field in contract_accounting_partner_fields
+    @api.model
+    @tools.ormcache_context(keys=("lang",))
+    def _get_accounting_partner_selection(self):
+        """ Accounting partner fields of the loaded hr.contract model, cached
+        per registry and language. """
+        Contract = self.env["hr.contract"]
+        strings = self.env["ir.translation"].get_field_string(Contract._name)
+        values = [
+            (name, strings.get(name) or field.string)
+            for name, field in Contract._fields.items()
+            if "_accounting_partner_id" in name
         ]
+        return tuple(sorted(values, key=lambda value: value[1]))
+
+    def _get_accounting_partner_values(self):
+        return list(self._get_accounting_partner_selection())
 
     debit_accounting_partner = fields.Selection(
         "_get_accounting_partner_values",
@@ -421,6 +1114,17 @@ class HrSalaryRule(models.Model):
     print_on_payslip_report = fields.Boolean(
         string="Imprimir en Comprobante", default=True
     )
+    evaluation_count = fields.Integer(
+        compute="_compute_evaluation_stats",
+        string="Evaluaciones",
+        help="Number of times the rule was computed by this server process.",
+    )
+    evaluation_time = fields.Float(
+        compute="_compute_evaluation_stats",
+        string="Tiempo de Evaluación (s)",
+        help="Time spent by this server process evaluating the condition and "
+        "the amount of the rule.",
+    )
     associated_leave_type_id = fields.Many2one(
         "hr.leave.type", string="Associated leave type"
     )
@@ -439,6 +1143,202 @@ class HrSalaryRule(models.Model):
         string="Etiqueta Reporte Retención",
     )
 
+    def _get_accounting_partner(self, contract, field_name):
+        if not field_name:
+            return None
+        partner = contract[field_name]
+        return partner.commercial_partner_id.id if partner else False
+
+    @api.multi
+    def _get_accounting_template(self):
+        """ Return the RuleAccountingTemplate of the rule. """
+        self.ensure_one()
+        return RuleAccountingTemplate(
+            self.account_debit.id,
+            self.account_credit.id,
+            self.debit_accounting_partner or False,
+            self.credit_accounting_partner or False,
+            self.analytic_account_id.id,
+            self.account_tax_id.id or False,
+            tuple(self.account_debit.tax_ids.ids),
+            tuple(self.account_credit.tax_ids.ids),
+        )
+
+    @api.model
+    def _resolve_accounting(self, template, contract, partners):
+        """ Return the RuleAccounting of ``template`` for ``contract``.
+
+        :param partners: dict in which the accounting partners of the contracts
+            are kept by ``(contract_id, field_name)``, shared by the calls of a
+            same computation
+        """
+        resolved = []
+        for field_name in (template.debit_partner_field, template.credit_partner_field):
+            key = (contract.id, field_name)
+            if key not in partners:
+                partners[key] = self._get_accounting_partner(contract, field_name)
+            resolved.append(partners[key])
+        return RuleAccounting(
+            template.debit_account_id,
+            template.credit_account_id,
+            resolved[0],
+            resolved[1],
+            template.analytic_account_id,
+            template.tax_line_id,
+            template.debit_tax_ids,
+            template.credit_tax_ids,
+        )
+
+    @api.model
+    def _get_accounting_stamp(self):
+        """ Return what changes whenever a rule, a structure or an account is
+        created, written or deleted. """
+        self.env.cr.execute(
+            """
+            SELECT count(*), max(write_date) FROM hr_salary_rule
+            UNION ALL
+            SELECT count(*), max(write_date) FROM hr_payroll_structure
+            UNION ALL
+            SELECT count(*), max(write_date) FROM account_account
+            """
+        )
+        return tuple(self.env.cr.fetchall())
+
+    @api.model
+    def _get_accounting_table(self, struct_id):
+        """ Return ``{rule_id: RuleAccountingTemplate}`` for all the rules of
+        the structure (and its parents). The partners depend on the contract,
+        they are resolved by _resolve_accounting.
+
+        The table is kept by the worker and built again once the rules,
+        structures or accounts changed, without clearing the ormcache of the
+        whole registry.
+        """
+        key = (self.env.cr.dbname, struct_id)
+        stamp = self._get_accounting_stamp()
+        if key in _ACCOUNTING_TABLES and _ACCOUNTING_TABLES[key][0] == stamp:
+            return _ACCOUNTING_TABLES[key][1]
+        struct = self.env["hr.payroll.structure"].browse(struct_id)
+        structures = struct._get_parent_structure()
+        rule_ids = [rule_id for rule_id, sequence in structures.get_all_rules()]
+        table = {
+            rule.id: rule._get_accounting_template() for rule in self.browse(rule_ids)
+        }
+        _ACCOUNTING_TABLES[key] = (stamp, table)
+        return table
+
+    @api.multi
+    def write(self, vals):
+        for key in [key for key in _RULE_CODE if key[0] in self.ids]:
+            del _RULE_CODE[key]
+        return super(HrSalaryRule, self).write(vals)
+
+    @api.multi
+    def _satisfy_condition(self, localdict):
+        """ Same as hr_payroll, with the compiled code cache. """
+        self.ensure_one()
+        started = time.time()
+        try:
+            if self.condition_select == "none":
+                return True
+            elif self.condition_select == "range":
+                try:
+                    result = _eval_rule_code(self.id, self.condition_range, localdict)
+                    return (
+                        self.condition_range_min <= result
+                        and result <= self.condition_range_max
+                        or False
+                    )
+                except Exception:
+                    raise UserError(
+                        _("Wrong range condition defined for salary rule %s (%s).")
+                        % (self.name, self.code)
+                    )
+            else:  # python code
+                try:
+                    _eval_rule_code(
+                        self.id,
+                        self.condition_python,
+                        localdict,
+                        mode="exec",
+                        nocopy=True,
+                    )
+                    return "result" in localdict and localdict["result"] or False
+                except Exception:
+                    raise UserError(
+                        _("Wrong python condition defined for salary rule %s (%s).")
+                        % (self.name, self.code)
+                    )
+        finally:
+            _RULE_STATS[self.id][1] += time.time() - started
+
+    @api.multi
+    def _compute_rule(self, localdict):
+        """ Same as hr_payroll, with the compiled code cache. """
+        self.ensure_one()
+        started = time.time()
+        try:
+            if self.amount_select == "fix":
+                try:
+                    return (
+                        self.amount_fix,
+                        float(_eval_rule_code(self.id, self.quantity, localdict)),
+                        100.0,
+                    )
+                except Exception:
+                    raise UserError(
+                        _("Wrong quantity defined for salary rule %s (%s).")
+                        % (self.name, self.code)
+                    )
+            elif self.amount_select == "percentage":
+                try:
+                    return (
+                        float(
+                            _eval_rule_code(
+                                self.id, self.amount_percentage_base, localdict
+                            )
+                        ),
+                        float(_eval_rule_code(self.id, self.quantity, localdict)),
+                        self.amount_percentage,
+                    )
+                except Exception:
+                    raise UserError(
+                        _(
+                            "Wrong percentage base or quantity defined for salary rule %s (%s)."
+                        )
+                        % (self.name, self.code)
+                    )
+            else:
+                try:
+                    _eval_rule_code(
+                        self.id,
+                        self.amount_python_compute,
+                        localdict,
+                        mode="exec",
+                        nocopy=True,
+                    )
+                    return (
+                        float(localdict["result"]),
+                        "result_qty" in localdict and localdict["result_qty"] or 1.0,
+                        "result_rate" in localdict and localdict["result_rate"] or 100.0,
+                    )
+                except Exception:
+                    raise UserError(
+                        _("Wrong python code defined for salary rule %s (%s).")
+                        % (self.name, self.code)
+                    )
+        finally:
+            stats = _RULE_STATS[self.id]
+            stats[0] += 1
+            stats[1] += time.time() - started
+
+    @api.multi
+    def _compute_evaluation_stats(self):
+        for rule in self:
+            rule.evaluation_count, rule.evaluation_time = _RULE_STATS.get(
+                rule.id, (0, 0.0)
+            )
+
 
 class HrHolidays(models.Model):
     _inherit = "hr.leave"
@@ -448,6 +1348,46 @@ class HrHolidays(models.Model):
     average_salary = fields.Float(string="Salario Promedio")
     total_salary = fields.Float(string="Total Pagado")
 
+    @api.multi
+    def _mark_payslips_stale(self):
+        """ Flag the draft payslips overlapping the validated leaves as stale. """
+        leaves = self.filtered(lambda leave: leave.state == "validate")
+        if not leaves:
+            return
+        domain = expression.OR(
+            [
+                [
+                    ("employee_id", "=", leave.employee_id.id),
+                    ("date_from", "<=", leave.date_to.date()),
+                    ("date_to", ">=", leave.date_from.date()),
+                ]
+                for leave in leaves
+            ]
+        )
+        self.env["hr.payslip"].search(
+            expression.AND([domain, [("state", "in", ("draft", "verify"))]])
+        )._mark_stale()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(HrHolidays, self).create(vals_list)
+        res._mark_payslips_stale()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        if STALE_LEAVE_FIELDS.intersection(vals):
+            self._mark_payslips_stale()
+        res = super(HrHolidays, self).write(vals)
+        if STALE_LEAVE_FIELDS.intersection(vals):
+            self._mark_payslips_stale()
+        return res
+
+    @api.multi
+    def unlink(self):
+        self._mark_payslips_stale()
+        return super(HrHolidays, self).unlink()
+
 
 class HrHolidaysStatus(models.Model):
     _inherit = "hr.leave.type"
@@ -515,6 +1455,25 @@ class ResPartner(models.Model):
         return res
 
 
+class AccountMove(models.Model):
+    _inherit = "account.move"
+
+    payslip_ids = fields.One2many("hr.payslip", "move_id", readonly=True)
+
+    @api.multi
+    def action_open_payslip_lines(self):
+        """ Show the payslip lines the entry was posted from, by employee. """
+        self.ensure_one()
+        return {
+            "name": _("Payslip Lines"),
+            "type": "ir.actions.act_window",
+            "res_model": "hr.payslip.line",
+            "view_mode": "tree,form",
+            "domain": [("slip_id", "in", self.payslip_ids.ids)],
+            "context": {"group_by": "employee_id"},
+        }
+
+
 class ResConfigSettings(models.TransientModel):
     _inherit = "res.config.settings"
 
@@ -528,10 +1487,19 @@ class ResConfigSettings(models.TransientModel):
         readonly=False,
     )
 
+    payslip_move_grouping = fields.Selection(
+        related="company_id.payslip_move_grouping", readonly=False
+    )
+    sparse_worked_days = fields.Boolean(
+        related="company_id.sparse_worked_days", readonly=False
+    )
+
     @api.onchange("company_id")
     def onchange_company_id(self):
         if self.company_id:
             self.payment_journal_id = self.company_id.payment_journal_id
+            self.payslip_move_grouping = self.company_id.payslip_move_grouping
+            self.sparse_worked_days = self.company_id.sparse_worked_days
 
 
 class ResCompany(models.Model):
@@ -540,6 +1508,61 @@ class ResCompany(models.Model):
     payment_journal_id = fields.Many2one(
         "account.journal", string="Journal used for payments generated from payslips."
     )
+    sparse_worked_days = fields.Boolean(
+        string="Solo Días Trabajados No Nulos",
+        help="Only store the worked days lines of a payslip with days or hours. "
+        "The payslip form still proposes every code, and salary rules read the "
+        "codes that aren't stored as zero.",
+    )
+    payslip_move_grouping = fields.Selection(
+        [
+            ("line", "Detallado"),
+            ("slip", "Resumido por Nómina"),
+            ("run", "Resumido por Lote de Nóminas"),
+        ],
+        string="Asientos de Nómina",
+        default="line",
+        required=True,
+        help="Detailed: one debit and one credit item per payslip line. "
+        "Summarized: items with the same account, partner, analytic account and "
+        "taxes are merged, in one entry per payslip or per payslip batch. The "
+        "payslip lines of an entry can be opened from the entry.",
+    )
+
+
+class ResCountryState(models.Model):
+    _inherit = "res.country.state"
+
+    @api.model
+    @tools.ormcache()
+    def _get_state_index(self):
+        """ Return the StateIndex of all states, built once per worker. """
+        codes = {}
+        by_code = {}
+        by_name = {}
+        for state in self.sudo().search_read([], ["name", "code", "country_id"]):
+            country_id = state["country_id"] and state["country_id"][0]
+            name = normalize_name(state["name"])
+            codes[state["id"]] = state["code"]
+            by_code.setdefault((country_id, state["code"]), state["id"])
+            by_name.setdefault((country_id, name), state["id"])
+            by_name.setdefault((False, name), state["id"])
+        return StateIndex(codes, by_code, by_name)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(ResCountryState, self).create(vals_list)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        return super(ResCountryState, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(ResCountryState, self).unlink()
 
 
 class ResCity(models.Model):
@@ -547,6 +1570,51 @@ class ResCity(models.Model):
 
     code = fields.Char(string=u"Código de Ciudad")
 
+    @api.model
+    @tools.ormcache()
+    def _get_city_index(self):
+        """ Return the CityIndex of all cities, built once per worker. """
+        state_codes = self.env["res.country.state"]._get_state_index().codes
+        by_id = {}
+        by_code = {}
+        by_name = {}
+        cities = self.sudo().search_read([], ["name", "code", "state_id", "country_id"])
+        for city in cities:
+            state_id = city["state_id"] and city["state_id"][0]
+            info = CityInfo(
+                city["id"],
+                city["code"],
+                state_id,
+                state_codes.get(state_id, False),
+                city["country_id"] and city["country_id"][0],
+            )
+            by_id[city["id"]] = info
+            name = normalize_name(city["name"])
+            by_code.setdefault((state_id, city["code"]), city["id"])
+            by_name.setdefault((state_id, name), city["id"])
+            by_name.setdefault((False, name), city["id"])
+        return CityIndex(by_id, by_code, by_name)
+
+    @api.model
+    def _get_city_info(self, city_id):
+        """ Return the CityInfo of ``city_id``, empty values if there is none. """
+        return self._get_city_index().by_id.get(city_id, EMPTY_CITY_INFO)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(ResCity, self).create(vals_list)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        return super(ResCity, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(ResCity, self).unlink()
+
 
 class AccountPayment(models.Model):
     _inherit = "account.payment"
@@ -556,16 +1624,66 @@ class AccountPayment(models.Model):
     @api.multi
     def post(self):
         res = super(AccountPayment, self).post()
-
+        by_run = defaultdict(lambda: self.browse())
         for payment in self.filtered("payslip_id"):
-            amls_to_reconcile = (
-                payment.move_line_ids | payment.payslip_id.move_id.line_ids
-            )
-            amls_to_reconcile = amls_to_reconcile.filtered(
-                lambda line: line.account_id
-                == payment.partner_id.property_account_payable_id
-                and line.partner_id == payment.partner_id
-            )
-            amls_to_reconcile.reconcile()
-
+            by_run[payment.payslip_id.payslip_run_id] |= payment
+        for run, payments in by_run.items():
+            matched, left_open = payments._reconcile_payslip_moves()
+            summary = _("%s lines matched, %s left open") % (matched, left_open)
+            if run:
+                run.payment_reconciliation = summary
+                continue
+            for payment in payments:
+                payment.message_post(
+                    body=_("Payslip payments reconciled together: %s") % summary
+                )
         return res
+
+    @api.multi
+    def _reconcile_payslip_moves(self):
+        """ Reconcile the payments with the journal entries of their payslips.
+
+        The payable lines of all payments and entries are fetched at once and
+        reconciled per partner and payable account.
+
+        :return: number of lines reconciled and number of lines left open
+        """
+        if not self:
+            return 0, 0
+        keys = {
+            (payment.partner_id.id, payment.partner_id.property_account_payable_id.id)
+            for payment in self
+        }
+        moves = self.mapped("move_line_ids.move_id") | self.mapped("payslip_id.move_id")
+        candidates = self.env["account.move.line"].search(
+            [
+                ("move_id", "in", moves.ids),
+                ("partner_id", "in", [partner_id for partner_id, account_id in keys]),
+                ("account_id", "in", [account_id for partner_id, account_id in keys]),
+                ("reconciled", "=", False),
+            ]
+        )
+
+        groups = defaultdict(lambda: self.env["account.move.line"])
+        for line in candidates:
+            key = (line.partner_id.id, line.account_id.id)
+            if key in keys:
+                groups[key] |= line
+
+        matched = left_open = 0
+        for lines in groups.values():
+            if len(lines) < 2:
+                left_open += len(lines)
+                continue
+            lines.reconcile()
+            reconciled = lines.filtered("reconciled")
+            matched += len(reconciled)
+            left_open += len(lines) - len(reconciled)
+
+        _logger.info(
+            "Reconciled %s payslip payments: %s lines matched, %s left open",
+            len(self),
+            matched,
+            left_open,
+        )
+        return matched, left_open
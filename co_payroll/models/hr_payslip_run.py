@@ -0,0 +1,211 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+import logging
+import random
+import time
+
+from psycopg2.extensions import TransactionRollbackError
+
+from odoo import api, fields, models, tools, _
+from odoo.tools import split_every
+
+from ..tools import parallel
+
+_logger = logging.getLogger(__name__)
+
+# payslips computed (and committed) together by a worker
+COMPUTE_CHUNK_SIZE = 50
+
+# a chunk hitting a serialization failure is computed again, at most this often
+COMPUTE_MAX_ATTEMPTS = 5
+
+# seconds to wait for the result of a chunk before giving up on the workers
+COMPUTE_CHUNK_TIMEOUT = 900
+
+
+def _compute_chunk(task):
+    """ Compute the payslips of a chunk in a worker process and commit them.
+
+    :return: ``(payslip_ids, attempts, elapsed_time, error)``
+    """
+    dbname, uid, context, payslip_ids = task
+    started = time.time()
+    for attempt in range(1, COMPUTE_MAX_ATTEMPTS + 1):
+        with api.Environment.manage(), parallel.worker_cursor(dbname) as cr:
+            env = api.Environment(cr, uid, context)
+            try:
+                env["hr.payslip"].browse(payslip_ids).compute_sheet()
+                cr.commit()
+                return payslip_ids, attempt, time.time() - started, None
+            except TransactionRollbackError:
+                cr.rollback()
+                if attempt == COMPUTE_MAX_ATTEMPTS:
+                    error = _("Too many serialization failures")
+                    return payslip_ids, attempt, time.time() - started, error
+                time.sleep(random.uniform(0.5, 2.0) * attempt)
+            except Exception as e:
+                _logger.exception("Could not compute payslips %s", payslip_ids)
+                cr.rollback()
+                return payslip_ids, attempt, time.time() - started, tools.ustr(e)
+
+
+class HrPayslipRun(models.Model):
+    _inherit = "hr.payslip.run"
+
+    processes = fields.Integer(
+        string="Procesos",
+        default=1,
+        help="Number of worker processes used to compute the payslips. The "
+        "payslips are computed in parallel chunks when greater than 1, in the "
+        "background by a scheduled action.",
+    )
+    compute_queued = fields.Boolean(
+        string="Cálculo en Cola",
+        readonly=True,
+        copy=False,
+        help="The draft payslips to compute are computed in parallel by a "
+        "scheduled action.",
+    )
+    payment_reconciliation = fields.Char(
+        string="Conciliación de Pagos",
+        readonly=True,
+        copy=False,
+        help="Journal items of the payments of the batch reconciled with the "
+        "entries of its payslips, and left open, when they were last posted.",
+    )
+    compute_error = fields.Text(
+        string="Errores de Cálculo",
+        readonly=True,
+        copy=False,
+        help="Payslips that could not be computed by the last parallel "
+        "computation. They are still to be computed.",
+    )
+
+    @api.multi
+    def _compute_sheets(self, payslips):
+        """ Compute ``payslips`` (of this run). When the run has more than one
+        process, they are flagged stale and the run is queued instead, to be
+        computed in parallel by the cron. """
+        self.ensure_one()
+        if self.processes > 1 and len(payslips) > 1:
+            payslips.filtered(lambda slip: not slip.is_stale).write(
+                {"is_stale": True}
+            )
+            self.write({"compute_queued": True, "compute_error": False})
+        else:
+            payslips.compute_sheet()
+            self.compute_error = False
+
+    @api.model
+    def _cron_compute_sheets(self):
+        """ Compute the stale draft payslips of the queued runs in parallel. """
+        for run in self.search([("compute_queued", "=", True)], order="id"):
+            payslips = run.slip_ids.filtered(
+                lambda slip: slip.state == "draft" and slip.is_stale
+            )
+            try:
+                if payslips:
+                    run._compute_sheets_parallel(payslips)
+                run.compute_queued = False
+                self.env.cr.commit()
+            except Exception as e:
+                _logger.exception("Payslip run %s could not be computed", run.id)
+                self.env.cr.rollback()
+                run.invalidate_cache()
+                run.write({"compute_queued": False, "compute_error": tools.ustr(e)})
+                self.env.cr.commit()
+
+    @api.multi
+    def _compute_sheets_parallel(self, payslips):
+        """ Compute ``payslips`` by chunks in worker processes. Every chunk is
+        computed in its own transaction, which is committed.
+
+        The numbers the sequential computation would give are assigned first,
+        and the current transaction is committed so the workers see them. This
+        commit is intended: it only runs in the cron, never in the transaction
+        of a request. The chunks that fail, or of which the worker didn't answer
+        in time, are reported in ``compute_error``; the payslips that were
+        computed are committed anyway.
+        """
+        self.ensure_one()
+        for payslip in payslips.filtered(lambda payslip: not payslip.number):
+            payslip.number = self.env["ir.sequence"].next_by_code("salary.slip")
+        self.env.cr.commit()
+
+        tasks = [
+            (self.env.cr.dbname, self.env.uid, dict(self.env.context), list(chunk))
+            for chunk in split_every(COMPUTE_CHUNK_SIZE, payslips.ids)
+        ]
+        started = time.time()
+        errors = []
+        done = 0
+        results = parallel.imap(
+            _compute_chunk, tasks, self.processes, timeout=COMPUTE_CHUNK_TIMEOUT
+        )
+        try:
+            for payslip_ids, attempts, elapsed, error in results:
+                done += 1
+                _logger.info(
+                    "Payslip run %s: chunk %s/%s of %s payslips %s in %.2fs "
+                    "(%s attempts)",
+                    self.id,
+                    done,
+                    len(tasks),
+                    len(payslip_ids),
+                    "failed" if error else "computed",
+                    elapsed,
+                    attempts,
+                )
+                if error:
+                    errors.append((payslip_ids, error))
+        except parallel.WorkerTimeout:
+            _logger.error(
+                "Payslip run %s: no result after %ss, %s chunks left",
+                self.id,
+                COMPUTE_CHUNK_TIMEOUT,
+                len(tasks) - done,
+            )
+            error = _("No answer from the worker processes in time")
+            errors += [(task[3], error) for task in tasks[done:]]
+        _logger.info(
+            "Payslip run %s: %s payslips computed in %.2fs",
+            self.id,
+            len(payslips),
+            time.time() - started,
+        )
+
+        # the payslips were written by the workers' transactions
+        payslips._invalidate_line_lookup()
+        self.invalidate_cache()
+        # the chunks left after a timeout may have been committed, only the
+        # payslips still stale are to be computed
+        Payslip = self.env["hr.payslip"]
+        failed = [
+            (Payslip.browse(ids).filtered("is_stale"), error) for ids, error in errors
+        ]
+        self.compute_error = (
+            "\n".join(
+                "%s: %s" % (", ".join(slips.mapped("name")), error)
+                for slips, error in failed
+                if slips
+            )
+            or False
+        )
+
+    @api.multi
+    def action_compute_sheets(self):
+        for run in self:
+            payslips = run.slip_ids.filtered(lambda slip: slip.state == "draft")
+            run._compute_sheets(payslips)
+        return True
+
+    @api.multi
+    def action_compute_stale_sheets(self):
+        """ Compute again the draft payslips of which the inputs changed. """
+        for run in self:
+            payslips = run.slip_ids.filtered(
+                lambda slip: slip.state == "draft" and slip.is_stale
+            )
+            if payslips:
+                run._compute_sheets(payslips)
+        return True
@@ -0,0 +1,2 @@
+# Copyright (C) 2019 Odoo Inc
+from . import parallel
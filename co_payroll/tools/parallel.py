@@ -0,0 +1,70 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+""" Helpers to spread work over a pool of forked worker processes.
+
+Workers never use the database connections inherited from the parent process,
+each one opens its own connection pool. The inherited pool is kept referenced
+in the worker: letting it be garbage collected would close the connections,
+and with them the sessions the parent is still using.
+"""
+from contextlib import contextmanager
+import multiprocessing
+import signal
+
+from odoo import sql_db
+
+_inherited_pool = None
+
+
+def _init_worker():
+    global _inherited_pool
+    # the parent's handlers (e.g. the server's graceful shutdown) make no sense here
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _inherited_pool = sql_db._Pool
+    sql_db._Pool = None
+
+
+def export_snapshot(cr):
+    """ Export the snapshot of the current transaction of ``cr`` so workers
+    can read exactly the same data. Only valid while that transaction lasts. """
+    cr.execute("SELECT pg_export_snapshot()")
+    return cr.fetchone()[0]
+
+
+@contextmanager
+def worker_cursor(dbname, snapshot=None):
+    """ Cursor on a new connection of the worker process. When a ``snapshot``
+    is given the transaction is read only and sees the snapshot's data. """
+    cr = sql_db.db_connect(dbname).cursor()
+    try:
+        if snapshot:
+            cr.execute("SET TRANSACTION READ ONLY")
+            cr.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        yield cr
+    finally:
+        cr.close()
+
+
+# raised by imap when a result doesn't come in time
+WorkerTimeout = multiprocessing.TimeoutError
+
+
+def imap(func, tasks, processes, timeout=None):
+    """ Apply ``func`` to every task in a pool of ``processes`` forked workers
+    and yield the results in the order of ``tasks``. ``func`` must be a module
+    level function, tasks and results must be picklable.
+
+    The task of a worker that dies (e.g. killed for its memory) is lost and its
+    result never comes: with a ``timeout``, WorkerTimeout is raised when a
+    result takes longer than that many seconds, and the pool is terminated.
+    """
+    context = multiprocessing.get_context("fork")
+    with context.Pool(processes, initializer=_init_worker) as pool:
+        results = pool.imap(func, tasks)
+        while True:
+            try:
+                result = results.next(timeout)
+            except StopIteration:
+                return
+            yield result
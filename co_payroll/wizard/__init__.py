@@ -1,2 +1,5 @@
 # Copyright (C) 2019 Odoo Inc
 from . import autoliquidaciones
+from . import hr_payroll_payslips_by_employees
+from . import master_data_import
+from . import worked_days_catalog
@@ -0,0 +1,125 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from collections import namedtuple
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# contributions are rounded up to a multiple of this
+ROUNDING = 100
+
+# what the contributions of a detail line are computed from; the rates are the
+# ones that apply to the line, 0 where the contribution is not due (e.g. no ARL
+# on leave lines)
+ContributionInput = namedtuple(
+    "ContributionInput",
+    [
+        "ibc",
+        "ibc_ccf",
+        "pension_rate",
+        "health_rate",
+        "arl_rate",
+        "ccf_rate",
+        "sena_rate",
+        "icbf_rate",
+        "solidarity",
+        "subsistence",
+    ],
+)
+
+# contributions of a detail line, in pesos
+Contribution = namedtuple(
+    "Contribution",
+    ["pension", "solidarity", "subsistence", "health", "arl", "ccf", "sena", "icbf"],
+)
+
+# contributions paid to every administrator: the kind of administrator, the
+# contract field of its partner (None for the national entities, which are the
+# same for everyone) and the contributions paid to it
+ADMINISTRATOR_CONTRIBUTIONS = [
+    (
+        "pension",
+        "pension_accounting_partner_id",
+        ("pension", "solidarity", "subsistence"),
+    ),
+    ("health", "social_security_accounting_partner_id", ("health",)),
+    ("ccf", "family_compensation_accounting_partner_id", ("ccf",)),
+    ("arl", "occupational_risks_accounting_partner_id", ("arl",)),
+    ("sena", None, ("sena",)),
+    ("icbf", None, ("icbf",)),
+]
+
+# which base and rate every contribution is computed from, None for the
+# amounts that are only rounded
+_FORMULAS = [
+    ("pension", "ibc", "pension_rate"),
+    ("solidarity", "solidarity", None),
+    ("subsistence", "subsistence", None),
+    ("health", "ibc", "health_rate"),
+    ("arl", "ibc", "arl_rate"),
+    ("ccf", "ibc_ccf", "ccf_rate"),
+    ("sena", "ibc_ccf", "sena_rate"),
+    ("icbf", "ibc_ccf", "icbf_rate"),
+]
+
+
+def round_up(value, nearest=ROUNDING):
+    """ Round ``value`` up to ``nearest``, e.g. 3211 to nearest 100 gives 3300. """
+    assert nearest > 0
+    return int(math.ceil(value / float(nearest)) * nearest)
+
+
+def _compute_scalar(inputs):
+    contributions = []
+    for line in inputs:
+        values = []
+        for name, base, rate in _FORMULAS:
+            value = getattr(line, base)
+            if rate:
+                value = value * getattr(line, rate)
+            values.append(round_up(value))
+        contributions.append(Contribution(*values))
+    return contributions
+
+
+def _compute_vectorized(inputs):
+    columns = {
+        name: numpy.array(values, dtype=numpy.float64)
+        for name, values in zip(ContributionInput._fields, zip(*inputs))
+    }
+    results = []
+    for name, base, rate in _FORMULAS:
+        value = columns[base] * columns[rate] if rate else columns[base]
+        # same operations as round_up, element wise, so the results are equal
+        rounded = numpy.ceil(value / float(ROUNDING)) * ROUNDING
+        results.append(rounded.astype(numpy.int64).tolist())
+    return [Contribution(*values) for values in zip(*results)]
+
+
+def compute_contributions(inputs):
+    """ Return the Contribution of every ContributionInput of ``inputs``.
+
+    The columns of a batch are computed at once with NumPy when it is
+    installed, one line at a time otherwise. Both give the same amounts.
+    """
+    if not inputs:
+        return []
+    if numpy is None:
+        return _compute_scalar(inputs)
+    return _compute_vectorized(inputs)
+
+
+def administrator_subtotals(contribution, administration_codes):
+    """ Return the ``((kind, administration code), amount)`` of the
+    contributions of a line, ``administration_codes`` being the codes of its
+    contract by field, as in EmployeeSnapshot. """
+    return tuple(
+        (
+            (kind, (administration_codes[field] or "") if field else ""),
+            sum(getattr(contribution, name) for name in names),
+        )
+        for kind, field, names in ADMINISTRATOR_CONTRIBUTIONS
+    )
@@ -0,0 +1,130 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from collections import namedtuple
+
+# contract fields holding the administrators the employee contributes to
+ADMINISTRATOR_FIELDS = (
+    "social_security_accounting_partner_id",
+    "pension_accounting_partner_id",
+    "occupational_risks_accounting_partner_id",
+    "family_compensation_accounting_partner_id",
+    "icbf_accounting_partner_id",
+    "sena_accounting_partner_id",
+    "men_accounting_partner_id",
+    "esap_accounting_partner_id",
+    "administrator_accounting_partner_id",
+    "order_accounting_partner_id",
+    "complementary_plan_accounting_partner_id",
+)
+
+# everything a detail line needs to know about an employee, its home address
+# and its current contract:
+# - administration_codes: {contract field: administration code} for every field
+#   of ADMINISTRATOR_FIELDS
+# - integral: the structure is exactly SAL_INT, has_integral: it contains it
+# - apprentice, apprentice_e, apprentice_el: the structure contains APR, APR_E
+#   or APR_EL
+# - contract_start, contract_end: dates of the contract that fall within the
+#   period, False otherwise
+EmployeeSnapshot = namedtuple(
+    "EmployeeSnapshot",
+    [
+        "employee_id",
+        "partner_id",
+        "contract_id",
+        "document_code",
+        "vat",
+        "last_name1",
+        "last_name2",
+        "name1",
+        "name2",
+        "state_code",
+        "city_code",
+        "quotient_type",
+        "quotient_subtype",
+        "wage",
+        "arl_type",
+        "struct_code",
+        "administration_codes",
+        "integral",
+        "has_integral",
+        "apprentice",
+        "apprentice_e",
+        "apprentice_el",
+        "contract_start",
+        "contract_end",
+    ],
+)
+
+
+def _in_period(day, date_start, date_end):
+    return day if day and date_start <= day <= date_end else False
+
+
+def _get_contracts(employees):
+    """ Return ``{employee_id: contract}``, the latest contract of every
+    employee as ``hr.employee.contract_id`` gives it, from a single search
+    instead of one per employee. """
+    contracts = {}
+    for contract in employees.env["hr.contract"].search(
+        [("employee_id", "in", employees.ids)], order="date_start desc"
+    ):
+        contracts.setdefault(contract.employee_id.id, contract)
+    return contracts
+
+
+def get_employee_snapshots(employees, date_start, date_end):
+    """ Return ``{employee_id: EmployeeSnapshot}`` for ``employees``.
+
+    The partners, contracts, structures and administrators of all the employees
+    are read in a few batches, once, so rendering the lines of the period
+    doesn't query them anymore.
+    """
+    env = employees.env
+    # read every record the snapshots are built from in batches
+    partners = employees.mapped("address_home_id")
+    contract_by_employee = _get_contracts(employees)
+    contracts = env["hr.contract"].browse(
+        [contract.id for contract in contract_by_employee.values()]
+    )
+    partners.mapped("city_id")
+    contracts.mapped("struct_id.code")
+    for name in ADMINISTRATOR_FIELDS:
+        contracts.mapped(name + ".administration_code")
+
+    snapshots = {}
+    for employee in employees:
+        partner = employee.address_home_id
+        contract = contract_by_employee.get(employee.id, env["hr.contract"])
+        city = env["res.city"]._get_city_info(partner.city_id.id)
+        struct_code = contract.struct_id.code or ""
+        snapshots[employee.id] = EmployeeSnapshot(
+            employee_id=employee.id,
+            partner_id=partner.id,
+            contract_id=contract.id,
+            document_code=partner._get_document_code(),
+            vat=partner._get_vat_without_verification_code(),
+            last_name1=partner.last_name1,
+            last_name2=partner.last_name2,
+            name1=partner.name1,
+            name2=partner.name2,
+            state_code=city.state_code,
+            city_code=city.code,
+            quotient_type=contract.quotient_type,
+            quotient_subtype=contract.quotient_subtype,
+            wage=contract.wage,
+            arl_type=contract.arl_type,
+            struct_code=struct_code,
+            administration_codes={
+                name: contract[name].administration_code
+                for name in ADMINISTRATOR_FIELDS
+            },
+            integral=struct_code == "SAL_INT",
+            has_integral="SAL_INT" in struct_code,
+            apprentice="APR" in struct_code,
+            apprentice_e="APR_E" in struct_code,
+            apprentice_el="APR_EL" in struct_code,
+            contract_start=_in_period(contract.date_start, date_start, date_end),
+            contract_end=_in_period(contract.date_end, date_start, date_end),
+        )
+    return snapshots
@@ -0,0 +1,290 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+# field types:
+# - A: alphanumeric, left aligned, padded with spaces and truncated to width
+# - N: number, right aligned and padded with zeroes
+# - F: rate, only 0 <= rate <= 1 appears in the file so a single leading 0
+# - D: date, already formatted as YYYY-MM-DD (or blank) by the wizard
+LayoutField = namedtuple(
+    "LayoutField", ["number", "name", "offset", "width", "type", "value"]
+)
+
+RECORD_END = "\r\n"
+
+BLANK_DATE = " " * len("YYYY-MM-DD")
+
+
+def field(number, name, offset, width, type="A", value=None):
+    """ Describe a field of a record. Fields with a ``value`` are constant,
+    they are formatted once when the layout is compiled. """
+    return LayoutField(number, name, offset, width, type, value)
+
+
+def _format_spec(field):
+    if field.type in ("A", "D"):
+        return ":<{length}.{length}".format(length=field.width)
+    if field.type == "N":
+        return ":>0{}.0f".format(field.width)
+    if field.type == "F":
+        assert field.width > 2, "Can't format a float with a length < 2"
+        return ":>01.{}f".format(field.width - 2)
+    raise ValueError("Unknown type %r for field %s" % (field.type, field.number))
+
+
+class RecordLayout(object):
+    """ Fixed width record compiled from a table of fields.
+
+    The table is checked once (offsets must follow each other and add up to
+    the record length) and turned into a single format string, so a record is
+    rendered from the tuple of its non constant values in one pass.
+    """
+
+    def __init__(self, name, fields, length):
+        self.name = name
+        self.length = length
+        self.fields = fields
+        self._fields_by_name = {}
+        self._specs = {}
+        self._string_positions = []
+        self._positions = {}
+
+        pieces = []
+        position = 0
+        offset = 0
+        for f in fields:
+            if f.offset != offset:
+                raise ValueError(
+                    "%s: field %s (%s) starts at %s instead of %s"
+                    % (name, f.number, f.name, f.offset, offset)
+                )
+            offset += f.width
+            spec = _format_spec(f)
+            self._fields_by_name[f.name] = f
+            self._specs[f.name] = "{" + spec + "}"
+
+            if f.value is not None:
+                constant = self.format_field(f.name, f.value)
+                pieces.append(constant.replace("{", "{{").replace("}", "}}"))
+            else:
+                if f.type in ("A", "D"):
+                    self._string_positions.append(position)
+                self._positions[f.name] = position
+                pieces.append("{%d%s}" % (position, spec))
+                position += 1
+
+        if offset != length:
+            raise ValueError(
+                "%s: fields add up to %s characters instead of %s"
+                % (name, offset, length)
+            )
+
+        self.arity = position
+        self._format = "".join(pieces) + RECORD_END
+
+    def render(self, values):
+        """ Render the record from the values of its non constant fields, in
+        record order. Empty strings may be given as ``False`` or ``None``. """
+        if len(values) != self.arity:
+            raise ValueError(
+                "%s: %s values given for %s fields"
+                % (self.name, len(values), self.arity)
+            )
+        values = list(values)
+        for position in self._string_positions:
+            values[position] = values[position] or ""
+        return self._format.format(*values)
+
+    def offset(self, name):
+        return self._fields_by_name[name].offset
+
+    def position(self, name):
+        """ Position of a non constant field in the values given to render. """
+        return self._positions[name]
+
+    def replace_field(self, record, name, value):
+        """ Return the rendered ``record`` with field ``name`` set to ``value``. """
+        f = self._fields_by_name[name]
+        return (
+            record[: f.offset]
+            + self.format_field(name, value)
+            + record[f.offset + f.width :]
+        )
+
+    def format_field(self, name, value):
+        """ Format a single field, e.g. to patch it into a rendered record. """
+        if self._fields_by_name[name].type in ("A", "D"):
+            value = value or ""
+        return self._specs[name].format(value)
+
+
+class DateFormatter(object):
+    """ Format the values of the date fields of a file as YYYY-MM-DD.
+
+    Datetimes are stored in UTC and shown in the timezone given, resolved once.
+    Dates are formatted as they are, there is no time to shift. Every value is
+    formatted once, the lines of a file repeat a handful of dates.
+    """
+
+    def __init__(self, tz_name):
+        try:
+            self._tz = pytz.timezone(tz_name) if tz_name else None
+        except pytz.UnknownTimeZoneError:
+            self._tz = None
+        self._formatted = {None: BLANK_DATE, False: BLANK_DATE}
+
+    def to_date(self, value):
+        """ Return the date of ``value`` in the timezone, as it is formatted. """
+        if isinstance(value, datetime) and self._tz:
+            return pytz.utc.localize(value).astimezone(self._tz).date()
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+
+    def format(self, value):
+        try:
+            return self._formatted[value]
+        except KeyError:
+            pass
+        day = value
+        if isinstance(value, datetime) and self._tz:
+            day = pytz.utc.localize(value).astimezone(self._tz)
+        self._formatted[value] = formatted = day.strftime("%Y-%m-%d")
+        return formatted
+
+
+HEADER_LAYOUT = RecordLayout(
+    "header",
+    [
+        field(1, "registration_type", 0, 2),
+        field(2, "plan_type", 2, 1),
+        field(3, "sequence", 3, 4, value="0001"),
+        field(4, "company_name", 7, 200),
+        field(5, "document_type", 207, 2),
+        # fields 6 and 7, identification number and check digit
+        field(6, "document_number", 209, 17),
+        field(8, "form_type", 226, 1, value="E"),
+        field(9, "associated_form", 227, 10, value=""),
+        field(10, "associated_form_date", 237, 10, value=""),
+        field(11, "presentation_type", 247, 1),
+        field(12, "branch_code", 248, 10, value=""),
+        field(13, "branch_name", 258, 40, value=""),
+        field(14, "arl_administrator", 298, 6),
+        field(15, "pension_period", 304, 7),
+        field(16, "health_period", 311, 7),
+        field(17, "filing_number", 318, 10, "N", value=0),
+        field(18, "payment_date", 328, 10, value=""),
+        field(19, "employee_count", 338, 5, "N"),
+        field(20, "total_payroll", 343, 12, "N"),
+        field(21, "provider_type", 355, 2, "N"),
+        field(22, "operator_code", 357, 2, "N"),
+    ],
+    359,
+)
+
+DETAIL_LAYOUT = RecordLayout(
+    "detail",
+    [
+        field(1, "record_type", 0, 2, value="02"),
+        field(2, "sequence", 2, 5, "N"),
+        field(3, "document_type", 7, 2),
+        field(4, "document_number", 9, 16),
+        field(5, "quotient_type", 25, 2),
+        field(6, "quotient_subtype", 27, 2),
+        field(7, "foreigner", 29, 1),
+        field(8, "colombian_abroad", 30, 1, value=""),
+        field(9, "state_code", 31, 2),
+        field(10, "city_code", 33, 3),
+        field(11, "last_name1", 36, 20),
+        field(12, "last_name2", 56, 30),
+        field(13, "name1", 86, 20),
+        field(14, "name2", 106, 30),
+        field(15, "ing", 136, 1),
+        field(16, "ret", 137, 1),
+        field(17, "tde", 138, 1),
+        field(18, "tae", 139, 1),
+        field(19, "tdp", 140, 1),
+        field(20, "tap", 141, 1),
+        field(21, "vsp", 142, 1),
+        field(22, "correction", 143, 1, value=""),
+        field(23, "vst", 144, 1),
+        field(24, "sln", 145, 1),
+        field(25, "ige", 146, 1),
+        field(26, "lma", 147, 1),
+        field(27, "vac", 148, 1),
+        field(28, "avp", 149, 1, value=""),
+        field(29, "vct", 150, 1, value=""),
+        field(30, "irl_days", 151, 2, "N"),
+        field(31, "pension_administrator", 153, 6),
+        field(32, "pension_administrator_transfer", 159, 6, value=""),
+        field(33, "health_administrator", 165, 6),
+        field(34, "health_administrator_transfer", 171, 6, value=""),
+        field(35, "ccf_administrator", 177, 6),
+        field(36, "pension_days", 183, 2, "N"),
+        field(37, "health_days", 185, 2, "N"),
+        field(38, "arl_days", 187, 2, "N"),
+        field(39, "ccf_days", 189, 2, "N"),
+        field(40, "wage", 191, 9, "N"),
+        field(41, "integral_wage", 200, 1),
+        field(42, "pension_ibc", 201, 9, "N"),
+        field(43, "health_ibc", 210, 9, "N"),
+        field(44, "arl_ibc", 219, 9, "N"),
+        field(45, "ccf_ibc", 228, 9, "N"),
+        field(46, "pension_rate", 237, 7, "F"),
+        field(47, "pension_contribution", 244, 9, "N"),
+        field(48, "voluntary_affiliate_contribution", 253, 9, "N", value=0),
+        field(49, "voluntary_employer_contribution", 262, 9, "N", value=0),
+        field(50, "pension_total", 271, 9, "N"),
+        field(51, "solidarity_fund", 280, 9, "N"),
+        field(52, "subsistence_fund", 289, 9, "N"),
+        field(53, "withheld_amount", 298, 9, "N", value=0),
+        field(54, "health_rate", 307, 7, "F"),
+        field(55, "health_contribution", 314, 9, "N"),
+        field(56, "upc", 323, 9, "N", value=0),
+        field(57, "ige_authorization", 332, 15, value=""),
+        field(58, "ige_amount", 347, 9, "N", value=0),
+        field(59, "lma_authorization", 356, 15, value=""),
+        field(60, "lma_amount", 371, 9, "N", value=0),
+        field(61, "arl_rate", 380, 9, "F"),
+        field(62, "work_center", 389, 9, "N"),
+        field(63, "arl_contribution", 398, 9, "N"),
+        field(64, "ccf_rate", 407, 7, "F"),
+        field(65, "ccf_contribution", 414, 9, "N"),
+        field(66, "sena_rate", 423, 7, "F"),
+        field(67, "sena_contribution", 430, 9, "N"),
+        field(68, "icbf_rate", 439, 7, "F"),
+        field(69, "icbf_contribution", 446, 9, "N"),
+        field(70, "esap_rate", 455, 7, "F", value=0),
+        field(71, "esap_contribution", 462, 9, "N", value=0),
+        field(72, "men_rate", 471, 7, "F", value=0),
+        field(73, "men_contribution", 478, 9, "N", value=0),
+        field(74, "main_document_type", 487, 2, value=""),
+        field(75, "main_document_number", 489, 16, value=""),
+        field(76, "exonerated", 505, 1),
+        field(77, "arl_administrator", 506, 6),
+        field(78, "arl_class", 512, 1),
+        field(79, "high_risk", 513, 1, value=""),
+        field(80, "ing_date", 514, 10, "D"),
+        field(81, "ret_date", 524, 10, "D"),
+        field(82, "vsp_date", 534, 10, "D"),
+        field(83, "sln_start", 544, 10, "D"),
+        field(84, "sln_end", 554, 10, "D"),
+        field(85, "ige_start", 564, 10, "D"),
+        field(86, "ige_end", 574, 10, "D"),
+        field(87, "lma_start", 584, 10, "D"),
+        field(88, "lma_end", 594, 10, "D"),
+        field(89, "vac_start", 604, 10, "D"),
+        field(90, "vac_end", 614, 10, "D"),
+        field(91, "vct_start", 624, 10, "D", value=""),
+        field(92, "vct_end", 634, 10, "D", value=""),
+        field(93, "irl_start", 644, 10, "D"),
+        field(94, "irl_end", 654, 10, "D"),
+        field(95, "ccf_ibc_other", 664, 9, "N"),
+        field(96, "worked_hours", 673, 3, "N"),
+    ],
+    676,
+)
@@ -0,0 +1,179 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+
+# a leave as indexed: its local dates, codes and days
+LeaveInterval = namedtuple(
+    "LeaveInterval", ["start", "end", "leave_id", "code", "status_id", "days"]
+)
+
+
+class LeaveIndex(object):
+    """ In-memory index of the validated leaves overlapping a period.
+
+    Built from a single ``hr.leave`` search, it answers every leave question
+    the autoliquidacion wizard asks for an employee (by ``leave_type_code`` or
+    by ``holiday_status_id``) without going back to the database.
+
+    The leaves of an employee never overlap, so they are kept as intervals
+    sorted by both their start and their end, and the ones overlapping any
+    range of dates of the period are found by bisection. A leave only partly
+    within a range counts for its share of ``number_of_days``, in proportion to
+    the hours of work of its days within the range: the days of a leave are
+    working days, weekends and holidays don't count. The hours of work of a
+    leave are only asked for the leaves crossing a range, once.
+
+    The "first" leave of a code is the first one of the search, the same one a
+    per-employee search would have returned first, and its dates are clipped
+    to the period.
+
+    :param leaves: the leaves, in the order ``get`` returns them
+    :param date_start, date_end: the period
+    :param to_date: callable giving the local date of a leave datetime
+    :param work_time: callable giving the ``[(date, hours)]`` of work of the
+        calendar of a leave's employee during the leave
+    """
+
+    def __init__(self, leaves, date_start, date_end, to_date, work_time):
+        self._leaves = leaves
+        self._date_start = date_start
+        self._date_end = date_end
+        self._work_time = work_time
+        self._work_hours = {}
+        self._by_employee = defaultdict(list)
+        self._first_by_code = {}
+        # {employee_id: [LeaveInterval]}, by start
+        self._intervals = defaultdict(list)
+
+        for leave in leaves:
+            start = to_date(leave.date_from)
+            end = to_date(leave.date_to)
+            if start > date_end or end < date_start:
+                continue
+            employee_id = leave.employee_id.id
+            code = leave.holiday_status_id.leave_type_code
+            interval = LeaveInterval(
+                start,
+                end,
+                leave.id,
+                code,
+                leave.holiday_status_id.id,
+                abs(leave.number_of_days),
+            )
+            self._by_employee[employee_id].append((code, leave.id))
+            self._intervals[employee_id].append(interval)
+            if (employee_id, code) not in self._first_by_code:
+                self._first_by_code[(employee_id, code)] = (
+                    max(start, date_start),
+                    min(end, date_end),
+                )
+
+        self._bounds = {}
+        for employee_id, intervals in self._intervals.items():
+            intervals.sort()
+            self._bounds[employee_id] = (
+                [interval.start for interval in intervals],
+                [interval.end for interval in intervals],
+            )
+
+    def _browse(self, ids):
+        return self._leaves.browse(ids).with_prefetch(self._leaves._prefetch)
+
+    def _range(self, date_start, date_end):
+        """ The range asked for, within the period (the only leaves indexed). """
+        return (
+            max(date_start or self._date_start, self._date_start),
+            min(date_end or self._date_end, self._date_end),
+        )
+
+    def _overlapping(self, employee_id, date_start, date_end):
+        """ Intervals of ``employee_id`` overlapping the range. """
+        if employee_id not in self._bounds:
+            return []
+        starts, ends = self._bounds[employee_id]
+        return self._intervals[employee_id][
+            bisect_left(ends, date_start) : bisect_right(starts, date_end)
+        ]
+
+    def _days_within(self, interval, date_start, date_end):
+        """ Share of the days of ``interval`` within the range. """
+        if date_start <= interval.start and interval.end <= date_end:
+            return interval.days
+        if interval.leave_id not in self._work_hours:
+            self._work_hours[interval.leave_id] = self._work_time(
+                self._browse(interval.leave_id)
+            )
+        work_hours = self._work_hours[interval.leave_id]
+        total = sum(hours for day, hours in work_hours)
+        if not total:
+            return 0.0
+        within = sum(
+            hours for day, hours in work_hours if date_start <= day <= date_end
+        )
+        return interval.days * within / total
+
+    def get(self, employee, codes):
+        """ Return the leaves of ``employee`` with one of the given codes. """
+        if not isinstance(codes, (list, tuple)):
+            codes = (codes,)
+        return self._browse(
+            [
+                leave_id
+                for code, leave_id in self._by_employee.get(employee.id, [])
+                if code in codes
+            ]
+        )
+
+    def all(self, employee):
+        """ Return all the leaves of ``employee``. """
+        return self._browse(
+            [leave_id for code, leave_id in self._by_employee.get(employee.id, [])]
+        )
+
+    def has(self, employee, code):
+        return (employee.id, code) in self._first_by_code
+
+    def first_start(self, employee, code):
+        """ Start of the first leave of ``code``, or of the period if the leave
+        started before it. """
+        return self._first_by_code.get((employee.id, code), (None, None))[0]
+
+    def first_end(self, employee, code):
+        """ End of the first leave of ``code``, or of the period if the leave
+        ends after it. """
+        return self._first_by_code.get((employee.id, code), (None, None))[1]
+
+    def days(self, employee, codes, date_start=None, date_end=None):
+        """ Days of the leaves of ``employee`` with one of the given codes
+        within ``date_start``..``date_end``, the period by default. """
+        if not isinstance(codes, (list, tuple)):
+            codes = (codes,)
+        date_start, date_end = self._range(date_start, date_end)
+        return sum(
+            self._days_within(interval, date_start, date_end)
+            for interval in self._overlapping(employee.id, date_start, date_end)
+            if interval.code in codes
+        )
+
+    def leave_days(self, leave, date_start=None, date_end=None):
+        """ Days of ``leave`` within ``date_start``..``date_end``, the period
+        by default. """
+        date_start, date_end = self._range(date_start, date_end)
+        return sum(
+            self._days_within(interval, date_start, date_end)
+            for interval in self._overlapping(
+                leave.employee_id.id, date_start, date_end
+            )
+            if interval.leave_id == leave.id
+        )
+
+    def total_days(self, employee, holiday_status, date_start=None, date_end=None):
+        """ Sum of the days of all leaves of ``employee`` of ``holiday_status``
+        within ``date_start``..``date_end``, the period by default. """
+        date_start, date_end = self._range(date_start, date_end)
+        return sum(
+            self._days_within(interval, date_start, date_end)
+            for interval in self._overlapping(employee.id, date_start, date_end)
+            if interval.status_id == holiday_status.id
+        )
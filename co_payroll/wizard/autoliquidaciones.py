@@ -2,9 +2,61 @@
 # Copyright (C) 2019 Odoo Inc
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
-from datetime import date, datetime
 import base64
+import hashlib
+import io
+import json
 import math
+import tempfile
+from datetime import timedelta
+from collections import defaultdict
+from weakref import WeakKeyDictionary
+
+from odoo.tools import float_round, split_every
+
+from ..tools import parallel
+from .autoliquidacion_contributions import (
+    ContributionInput,
+    administrator_subtotals,
+    compute_contributions,
+)
+from .autoliquidacion_employees import get_employee_snapshots
+from .autoliquidacion_layout import DETAIL_LAYOUT, HEADER_LAYOUT, DateFormatter
+from .autoliquidacion_leaves import LeaveIndex
+
+# the file is spooled to disk once it grows past this size
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+# payslips are split in this many shards per process, to even out the load
+SHARDS_PER_PROCESS = 4
+
+ATTACHMENT_NAME = "autoliquidacion_report.txt"
+
+# cached lines are rendered again once they were rendered by another version
+# of _prepare_line, bump it whenever the rendering of a line changes
+LINE_CACHE_VERSION = 6
+
+# rendered lines are saved in the cache by batches of this many payslips
+LINE_CACHE_BATCH = 500
+
+# the payslips of the period are read by chunks of this many, the cache is
+# cleared between two chunks
+REPORT_CHUNK_SIZE = 1000
+
+# the contributions of the lines of this many payslips are computed together
+CONTRIBUTION_BATCH = 200
+
+# DateFormatter of the wizards, per environment cache
+_DATE_FORMATTERS = WeakKeyDictionary()
+
+
+def _render_shard(task):
+    """ Render the lines of a shard of payslips in a worker process. """
+    dbname, uid, context, wizard_id, snapshot, payslip_ids = task
+    with api.Environment.manage(), parallel.worker_cursor(dbname, snapshot) as cr:
+        env = api.Environment(cr, uid, context)
+        wizard = env["co_payroll.autoliquidacion_report"].browse(wizard_id)
+        return list(wizard._render_payslips(env["hr.payslip"].browse(payslip_ids)))
 
 
 class AutoliquidacionReportWizard(models.TransientModel):
@@ -35,69 +87,95 @@ class AutoliquidacionReportWizard(models.TransientModel):
     registration_type = fields.Char(
         required=True, string="Tipo de Registros", default="01"
     )  # todo jov
+    processes = fields.Integer(
+        string="Procesos",
+        default=1,
+        help="Number of worker processes used to generate the lines. The "
+        "payslips are split by employee and generated in parallel when greater "
+        "than 1.",
+    )
+
+    def _get_payslip_domain(self):
+        return [
+            ("date_from", "=", self.payslip_date_start),
+            ("date_to", "=", self.payslip_date_end),
+        ]
 
     def _get_payslips(self):
-        return self.env["hr.payslip"].search(
+        return self.env["hr.payslip"].search(self._get_payslip_domain())
+
+    def _iter_payslip_chunks(self):
+        """ Yield the payslips of the period by chunks of REPORT_CHUNK_SIZE.
+
+        Every chunk has its own prefetch set, and the cache of the environment
+        is cleared once the caller is done with a chunk: the memory used stays
+        the same whatever the number of payslips.
+        """
+        Payslip = self.env["hr.payslip"]
+        for payslip_ids in split_every(REPORT_CHUNK_SIZE, self._get_payslips().ids):
+            payslips = Payslip.browse(payslip_ids)
+            yield payslips
+            payslips._invalidate_line_lookup()
+            Payslip.invalidate_cache()
+
+    def _get_leaves(self, employees):
+        return self.env["hr.leave"].search(
             [
-                ("date_from", "=", self.payslip_date_start),
-                ("date_to", "=", self.payslip_date_end),
+                ("employee_id", "in", employees.ids),
+                ("state", "=", "validate"),
+                # a day of margin on each side, for the timezone of the user
+                ("date_from", "<", self.payslip_date_end + timedelta(days=2)),
+                ("date_to", ">=", self.payslip_date_start - timedelta(days=1)),
             ]
         )
 
-    def _get_leaves(self, employee, holiday_statuses=False, codes=False):
-        if not isinstance(codes, (list, tuple)):
-            codes = (codes,)
-
-        domain = [
-            ("employee_id", "=", employee.id),
-            ("state", "=", "validate"),
-            ("date_from", ">=", self.payslip_date_start),
-            ("date_from", "<=", self.payslip_date_end),
-        ]
-
-        if any(codes):
-            domain += [("holiday_status_id.leave_type_code", "in", codes)]
-        if holiday_statuses:
-            domain += [("holiday_status_id", "in", holiday_statuses.ids)]
+    def _get_leave_index(self, employees):
+        """ Fetch all validated leaves overlapping the period at once. Every
+        leave lookup made while generating the lines is answered by the index,
+        in the dates of the user's timezone. """
+        return LeaveIndex(
+            self._get_leaves(employees),
+            self.payslip_date_start,
+            self.payslip_date_end,
+            self._get_date_formatter().to_date,
+            self._get_leave_work_time,
+        )
 
-        return self.env["hr.leave"].search(domain)
+    def _get_leave_work_time(self, leave):
+        """ Hours of work per day of the employee's calendar during ``leave``,
+        the leave itself left out: the days its ``number_of_days`` counts. """
+        return leave.employee_id.list_work_time_per_day(
+            leave.date_from,
+            leave.date_to,
+            domain=[("time_type", "=", "leave"), ("holiday_id", "!=", leave.id)],
+        )
 
-    def _find_start_first_leave(self, employee, code):
-        all_leaves = self._get_leaves(employee, codes=code)
-        return all_leaves[0].date_from if all_leaves else None
+    def _get_leave_days(self, leaves, leave):
+        """ Days of ``leave`` within the period, rounded to the whole days the
+        file reports. """
+        return int(float_round(leaves.leave_days(leave), precision_digits=0))
 
-    def _find_end_first_leave(self, employee, code):
-        all_leaves = self._get_leaves(employee, codes=code)
-        return all_leaves[0].date_to if all_leaves else None
+    def _get_employee_snapshots(self, employees):
+        """ Read the employees, their home address and contract at once. The
+        lines are rendered from the snapshots without any further query. """
+        return get_employee_snapshots(
+            employees, self.payslip_date_start, self.payslip_date_end
+        )
 
-    def _get_leaves_needing_separate_lines(self, employee):
+    def _get_leaves_needing_separate_lines(self, leaves, employee):
         LEAVE_TYPES = ("VAC", "LR", "IGE", "LMA", "SLN", "IRP", "RET")
-        return self._get_leaves(employee, codes=LEAVE_TYPES)
+        return leaves.get(employee, LEAVE_TYPES)
 
     def _get_line_total(self, payslip, code):
-        matching_lines = payslip.line_ids.filtered(lambda l: l.code == code)
-        return abs(matching_lines[0].total) if matching_lines else 0
+        return abs(payslip._get_line_lookup().total(code))
 
     def _get_percentage(self, payslip, code):
-        return sum(
-            payslip.line_ids.filtered(
-                lambda l: l.code in (code, "{}_AD".format(code))
-            ).mapped(lambda l: l.rate / 100.0)
-        )
+        return payslip._get_line_lookup().rate((code, "{}_AD".format(code)))
 
     def _get_number_of_worked_days(self, payslip):
-        return abs(
-            payslip.worked_days_line_ids.filtered(
-                lambda l: l.code == "WORK100"
-            ).number_of_days
-        )
+        return abs(payslip._get_line_lookup().worked_days("WORK100"))
 
-    def _round_to_nearest(self, value, nearest):
-        """ Round ``value`` up to ``nearest``. E.g. rounding 3211 to nearest 100 gives 3300. """
-        assert nearest > 0
-        return int(math.ceil(value / float(nearest)) * nearest)
-
-    def _get_arl_value(self, contract):
+    def _get_arl_value(self, snapshot):
         ARL_TYPE_TO_VALUE = {
             "0": 0.0000000,
             "I": 0.0052200,
@@ -106,9 +184,9 @@ class AutoliquidacionReportWizard(models.TransientModel):
             "IV": 0.0435000,
             "V": 0.0696000,
         }
-        return ARL_TYPE_TO_VALUE[contract.arl_type]
+        return ARL_TYPE_TO_VALUE[snapshot.arl_type]
 
-    def _get_arl_number(self, contract):
+    def _get_arl_number(self, snapshot):
         ARL_TYPE_TO_NUMBER = {
             "0": " ",
             "I": "1",
@@ -117,9 +195,9 @@ class AutoliquidacionReportWizard(models.TransientModel):
             "IV": "4",
             "V": "5",
         }
-        return ARL_TYPE_TO_NUMBER[contract.arl_type]
+        return ARL_TYPE_TO_NUMBER[snapshot.arl_type]
 
-    def _get_work_center(self, contract):
+    def _get_work_center(self, snapshot):
         ARL_TYPE_TO_WORK_CENTER = {
             "0": 0,  # TBD in spec
             "I": 2,
@@ -128,303 +206,169 @@ class AutoliquidacionReportWizard(models.TransientModel):
             "IV": 0,  # TBD in spec
             "V": 5,
         }
-        return ARL_TYPE_TO_WORK_CENTER[contract.arl_type]
-
-    def _format_string(self, string, length):
-        # strings should be formatted as follows:
-        # - left aligned
-        # - padded with spaces to the right
-        # - truncated to length to ensure the lines stay the correct length
-        return ("{" + ":<{length}.{length}".format(length=length) + "}").format(
-            string or ""
-        )
-
-    def _format_number(self, number, length):
-        # numbers should be formatted as follows:
-        # - right aligned
-        # - padded with zeroes to the left
-        return ("{" + ":>0{}.0f".format(length) + "}").format(number)
-
-    def _format_float(self, number, length):
-        # floats only appear in the file in the following range 0 <=
-        # number <= 1. So we can just format with a single leading 0.
-        assert length > 2, "Can't format a float with a length < 2"
-        return ("{" + ":>01.{}f".format(length - 2) + "}").format(number)
+        return ARL_TYPE_TO_WORK_CENTER[snapshot.arl_type]
+
+    def _get_date_formatter(self):
+        """ Return the DateFormatter of the wizard, in the user's timezone. """
+        formatters = _DATE_FORMATTERS.setdefault(self.env.cache, {})
+        if self.id not in formatters:
+            formatters[self.id] = DateFormatter(
+                self.env.context.get("tz") or self.env.user.tz
+            )
+        return formatters[self.id]
 
     def _format_datetime(self, dt):
-        if not dt:
-            return " " * len("YYYY-MM-DD")
-
-        if isinstance(dt, date):
-            dt = datetime(dt.year, dt.month, dt.day)
-
-        # dates should be formatted as YYYY-MM-DD
-        dt = fields.Datetime.context_timestamp(
-            self, dt
-        )  # convert from UTC to user's timezone
-        return dt.strftime("%Y-%m-%d")
+        # dates should be formatted as YYYY-MM-DD, datetimes in the user's timezone
+        return self._get_date_formatter().format(dt or None)
 
     def _format_datetime_for_leave(
-        self, employee, leave, leave_type_code, start_first_leave
+        self, leaves, employee, leave, leave_type_code, start_first_leave
     ):
         if leave and leave.holiday_status_id.leave_type_code == leave_type_code:
             if start_first_leave:
                 return self._format_datetime(
-                    self._find_start_first_leave(employee, leave_type_code)
+                    leaves.first_start(employee, leave_type_code)
                 )
             else:
                 return self._format_datetime(
-                    self._find_end_first_leave(employee, leave_type_code)
+                    leaves.first_end(employee, leave_type_code)
                 )
         else:
             return self._format_datetime(None)
 
     def _get_hours_for_worked_days_with_codes(self, payslip, codes):
-        if not isinstance(codes, (list, tuple)):
-            codes = (codes,)
-        return sum(
-            payslip.worked_days_line_ids.filtered(lambda l: l.code in codes).mapped(
-                "number_of_hours"
-            )
-        )
+        return payslip._get_line_lookup().worked_hours(codes)
 
     def _generate_header(self):
-        header = ""
-
-        header += self._format_string(self.registration_type, 2)
-        header += self._format_string(self.plan_type, 1)
-        header += "0001"
-        header += self._format_string(self.env.user.company_id.partner_id.name, 200)
-        header += self._format_string(
-            self.env.user.company_id.partner_id._get_document_code(), 2
-        )
-        header += self._format_string(self.env.user.company_id.partner_id.vat, 17)
-        header += "E"
-        header += self._format_string("", 10)
-        header += self._format_string("", 10)
-        header += self._format_string(self.presentation_type, 1)
-        header += self._format_string("", 10)
-        header += self._format_string("", 40)
-        header += self._format_string(
-            self.env.user.company_id.partner_id.administration_code, 6
+        company_partner = self.env.user.company_id.partner_id
+        employee_count = len(
+            self.env["hr.payslip"].read_group(
+                self._get_payslip_domain(), ["employee_id"], ["employee_id"]
+            )
         )
 
         # todo jov: raise if payslip_date_start and payslip_date_end aren't in the same month?
-        payslip_date = self.payslip_date_start
-        header += self._format_string(payslip_date.strftime("%Y-%m"), 7)
-
-        reporting_date = self.report_date_start
-        header += self._format_string(reporting_date.strftime("%Y-%m"), 7)
-
-        header += self._format_number(0, 10)
-        header += self._format_string("", 10)
-
-        payslips = self._get_payslips()
-        header += self._format_number(len(payslips.mapped("employee_id")), 5)
-
-        # field 20, this will be filled in after generating the whole file
-        header += self._format_number(0, 12)
+        return HEADER_LAYOUT.render(
+            (
+                self.registration_type,  # field 1
+                self.plan_type,
+                company_partner.name,  # field 4
+                company_partner._get_document_code(),
+                company_partner.vat,
+                self.presentation_type,  # field 11
+                company_partner.administration_code,  # field 14
+                self.payslip_date_start.strftime("%Y-%m"),
+                self.report_date_start.strftime("%Y-%m"),
+                employee_count,  # field 19
+                0,  # field 20, this will be filled in after generating the whole file
+                self.provider_type,
+                self.information_operator_code,
+            )
+        )
 
-        header += self._format_number(self.provider_type, 2)
-        header += self._format_number(self.information_operator_code, 2)
-        header += "\r\n"
+    def _prepare_line(self, index, payslip, leave, leaves, snapshot):
+        """ Return ``(values, inputs, ibc_ccf)``: the values of the detail line
+        but the contributions, left to 0, and the ContributionInput they are
+        computed from. """
+        employee = payslip.employee_id
+        lookup = payslip._get_line_lookup()
+        document_code = snapshot.document_code
+        administration_codes = snapshot.administration_codes
+        leave_type_code = leave.holiday_status_id.leave_type_code if leave else None
+
+        values = [
+            index,  # field 2
+            document_code,
+            snapshot.vat,
+            snapshot.quotient_type,
+            snapshot.quotient_subtype,  # field 6
+            "X" if document_code in ("CE", "PA", "CD") else " ",
+            snapshot.state_code,  # field 9
+            snapshot.city_code,
+            snapshot.last_name1,
+            snapshot.last_name2,
+            snapshot.name1,
+            snapshot.name2,
+        ]
 
-        return header
+        values += [
+            "X" if snapshot.contract_start else " ",  # field 15
+            "X" if snapshot.contract_end else " ",
+            "X" if leaves.has(employee, "TDE") else " ",
+            "X" if leaves.has(employee, "TAE") else " ",
+            "X" if leaves.has(employee, "TDP") else " ",
+            "X" if leaves.has(employee, "TAP") else " ",  # field 20
+            "X" if leaves.has(employee, "VSP") else " ",
+        ]
 
-    def _generate_line(self, index, payslip, leave):
-        line = ""
-        employee = payslip.employee_id
-        partner = employee.address_home_id
-        contract = employee.contract_id
-        document_code = partner._get_document_code()
-
-        line += "02"  # field 1
-        line += self._format_number(index, 5)
-        line += self._format_string(document_code, 2)
-        line += self._format_string(partner._get_vat_without_verification_code(), 16)
-        line += self._format_string(contract.quotient_type, 2)
-        line += self._format_string(contract.quotient_subtype, 2)  # field 6
-        line += "X" if document_code in ("CE", "PA", "CD") else " "
-        line += " "
-        line += self._format_string(partner.city_id.state_id.code, 2)
-        line += self._format_string(partner.city_id.code, 3)  # 10
-        line += self._format_string(partner.last_name1, 20)
-        line += self._format_string(partner.last_name2, 30)
-        line += self._format_string(partner.name1, 20)
-        line += self._format_string(partner.name2, 30)
-        contract_start = self.env["hr.contract"].search(
-            [
-                ("id", "=", contract.id),  # field 15
-                ("date_start", ">=", self.payslip_date_start),
-                ("date_start", "<=", self.payslip_date_end),
-            ]
-        )
-        line += "X" if contract_start else " "
-        contract_end = self.env["hr.contract"].search(
-            [
-                ("id", "=", contract.id),  # field 16
-                ("date_end", ">=", self.payslip_date_start),
-                ("date_end", "<=", self.payslip_date_end),
-            ]
-        )
-        line += "X" if contract_end else " "
-        line += "X" if self._get_leaves(employee, codes="TDE") else " "
-        line += "X" if self._get_leaves(employee, codes="TAE") else " "
-        line += "X" if self._get_leaves(employee, codes="TDP") else " "
-        line += "X" if self._get_leaves(employee, codes="TAP") else " "  # 20
-        line += "X" if self._get_leaves(employee, codes="VSP") else " "
-        line += " "
-
-        # 23
+        # field 23
         if (
             leave
-            or self._get_line_total(payslip, "IBC_L") == contract.wage
-            or "SAL_INT" in contract.struct_id.code
-            or "APR" in contract.struct_id.code
+            or self._get_line_total(payslip, "IBC_L") == snapshot.wage
+            or snapshot.has_integral
+            or snapshot.apprentice
         ):
-            line += " "
+            values.append(" ")
         else:
-            line += "X"
+            values.append("X")
 
-        line += (
-            "X"
-            if leave
-            and leave.holiday_status_id.leave_type_code == "SLN"
-            and self._get_leaves(employee, codes="SLN")
-            else " "
-        )
-        line += (
+        values += [
+            "X" if leave_type_code == "SLN" and leaves.has(employee, "SLN") else " ",
+            "X" if leave_type_code == "IGE" and leaves.has(employee, "IGE") else " ",
+            "X" if leave_type_code == "LMA" and leaves.has(employee, "LMA") else " ",
             "X"
-            if leave
-            and leave.holiday_status_id.leave_type_code == "IGE"
-            and self._get_leaves(employee, codes="IGE")
-            else " "
-        )
-        line += (
-            "X"
-            if leave
-            and leave.holiday_status_id.leave_type_code == "LMA"
-            and self._get_leaves(employee, codes="LMA")
-            else " "
-        )
-        line += (
-            "X"
-            if leave
-            and leave.holiday_status_id.leave_type_code == "VAC"
-            and self._get_leaves(employee, codes="VAC")
+            if leave_type_code == "VAC" and leaves.has(employee, "VAC")
             else "L"
-            if leave
-            and leave.holiday_status_id.leave_type_code == "LR"
-            and self._get_leaves(employee, codes="LR")
-            else " "
-        )
-        line += " "
-        line += " "
+            if leave_type_code == "LR" and leaves.has(employee, "LR")
+            else " ",
+        ]
 
         # field 30
-        if leave and leave.holiday_status_id.leave_type_code == "IRP":
-            line += self._format_number(abs(leave.number_of_days), 2)
-        else:
-            line += self._format_number(0, 2)
-
-        line += self._format_string(
-            contract.pension_accounting_partner_id.administration_code, 6
-        )
-        line += self._format_string(" ", 6)
-        line += self._format_string(
-            contract.social_security_accounting_partner_id.administration_code, 6
-        )
-        line += self._format_string(" ", 6)
-        line += self._format_string(
-            contract.family_compensation_accounting_partner_id.administration_code, 6
+        values.append(
+            self._get_leave_days(leaves, leave) if leave_type_code == "IRP" else 0
         )
 
+        values += [
+            administration_codes["pension_accounting_partner_id"],  # field 31
+            administration_codes["social_security_accounting_partner_id"],
+            administration_codes["family_compensation_accounting_partner_id"],
+        ]
+
         # field 36, 37, 38, 39
         if not leave:
-            if contract.quotient_subtype in ("01", "02"):
-                line += self._format_number(0, 2)
-            else:
-                line += self._format_number(
-                    self._get_number_of_worked_days(payslip)
-                    if "APR_E" not in contract.struct_id.code
-                    else 0,
-                    2,
-                )
-            line += self._format_number(self._get_number_of_worked_days(payslip), 2)
-            line += self._format_number(
-                self._get_number_of_worked_days(payslip)
-                if "APR_EL" not in contract.struct_id.code
-                else 0,
-                2,
-            )
-            line += self._format_number(
-                self._get_number_of_worked_days(payslip)
-                if "APR_E" not in contract.struct_id.code
-                else 0,
-                2,
-            )
+            days = self._get_number_of_worked_days(payslip)
         else:
-            if contract.quotient_subtype in ("01", "02"):
-                line += self._format_number(0, 2)
-            else:
-                line += self._format_number(
-                    abs(leave.number_of_days)
-                    if "APR_E" not in contract.struct_id.code
-                    else 0,
-                    2,
-                )
-            line += self._format_number(abs(leave.number_of_days), 2)
-            line += self._format_number(
-                abs(leave.number_of_days)
-                if "APR_EL" not in contract.struct_id.code
-                else 0,
-                2,
-            )
-            line += self._format_number(
-                abs(leave.number_of_days)
-                if "APR_E" not in contract.struct_id.code
-                else 0,
-                2,
-            )
+            days = self._get_leave_days(leaves, leave)
+        if snapshot.quotient_subtype in ("01", "02"):
+            values.append(0)
+        else:
+            values.append(days if not snapshot.apprentice_e else 0)
+        values += [
+            days,
+            days if not snapshot.apprentice_el else 0,
+            days if not snapshot.apprentice_e else 0,
+        ]
 
-        line += self._format_number(contract.wage, 9)
-        line += "X" if contract.struct_id.code == "SAL_INT" else " "
+        values += [
+            snapshot.wage,  # field 40
+            "X" if snapshot.integral else " ",
+        ]
 
         ibc_ccf = 0
         # fields 42, 43, 44, 45
         if not leave:
             ibc_total = self._get_line_total(payslip, "IBC_AUT")
-            if contract.quotient_subtype in ("01", "02"):
-                line += self._format_number(0, 9)
-            else:
-                line += self._format_number(
-                    ibc_total if "APR_E" not in contract.struct_id.code else 0, 9
-                )
-            line += self._format_number(ibc_total, 9)
-            line += self._format_number(
-                ibc_total if "APR_EL" not in contract.struct_id.code else 0, 9
-            )
 
             # exception for field 45, don't take IBC_AUT
-            if contract.struct_id.code == "SAL_INT":
+            if snapshot.integral:
                 ibc_ccf = self._get_line_total(payslip, "GROSS_70")
             else:
-                ibc_ccf = sum(
-                    payslip.line_ids.filtered(
-                        lambda l: l.category_id.code in ("ING", "HOR", "MAYVAL")
-                    ).mapped("total")
-                )
-
-            line += self._format_number(ibc_ccf, 9)
+                ibc_ccf = lookup.category_total(("ING", "HOR", "MAYVAL"))
         else:
-            total_days = sum(
-                self._get_leaves(
-                    employee, holiday_statuses=leave.holiday_status_id
-                ).mapped(lambda l: abs(l.number_of_days))
-            )
-            if leave.holiday_status_id.leave_type_code == "VAC":
+            total_days = leaves.total_days(employee, leave.holiday_status_id)
+            if leave_type_code == "VAC":
                 ibc_total = self._get_line_total(payslip, "IBC_AUT_VACA") * (
-                    abs(leave.number_of_days) / total_days
+                    leaves.leave_days(leave) / total_days
                 )
             else:
                 if not leave.holiday_status_id.salary_rule_ids:
@@ -441,290 +385,470 @@ class AutoliquidacionReportWizard(models.TransientModel):
                             "code"
                         )
                     ]
-                ) * (abs(leave.number_of_days) / total_days)
-            if contract.quotient_subtype in ("01", "02"):
-                line += self._format_number(0, 9)
-            else:
-                line += self._format_number(
-                    ibc_total if "APR_E" not in contract.struct_id.code else 0, 9
-                )
-            line += self._format_number(ibc_total, 9)
-            line += self._format_number(
-                ibc_total if "APR_EL" not in contract.struct_id.code else 0, 9
-            )
+                ) * (leaves.leave_days(leave) / total_days)
 
             ibc_ccf = ibc_total
-            line += self._format_number(ibc_ccf, 9)
 
+        if snapshot.quotient_subtype in ("01", "02"):
+            values.append(0)
+        else:
+            values.append(ibc_total if not snapshot.apprentice_e else 0)
+        values += [
+            ibc_total,
+            ibc_total if not snapshot.apprentice_el else 0,
+            ibc_ccf,
+        ]
+
+        # field 46
         pension_rate = self._get_percentage(payslip, "201") + self._get_percentage(
             payslip, "AP_PENSION"
         )
-        line += self._format_float(pension_rate, 7)  # field 46
+        values.append(pension_rate)
 
-        # field 47
-        if (
-            leave
-            and leave.holiday_status_id.leave_type_code == "VAC"
-            and "LVACA" in payslip.line_ids.mapped("code")
-        ):
-            field_47_value = 0
-        else:
-            field_47_value = self._round_to_nearest(ibc_total * pension_rate, 100)
-        line += self._format_number(field_47_value, 9)
-
-        field_48_value = 0
-        line += self._format_number(field_48_value, 9)  # field 48
-        field_49_value = 0
-        line += self._format_number(field_49_value, 9)
-        line += self._format_number(field_47_value + field_48_value + field_49_value, 9)
-
-        line += self._format_number(
-            self._round_to_nearest(
-                self._get_line_total(payslip, "aut_solidaridad_sol"), 100
-            ),
-            9,
-        )  # field 51
-        line += self._format_number(
-            self._round_to_nearest(
-                self._get_line_total(payslip, "aut_solidaridad_subs"), 100
-            ),
-            9,
+        # field 47, fields 48 and 49 are always 0, fields 50, 51 and 52
+        no_vacation_contribution = leave_type_code == "VAC" and lookup.has_code(
+            "LVACA"
         )
+        values += [0, 0, 0, 0]
 
-        line += self._format_number(0, 9)
-
+        # field 54
         healthcare_rate = self._get_percentage(payslip, "200") + self._get_percentage(
             payslip, "AP_SAL"
         )
-        line += self._format_float(healthcare_rate, 7)
+        values.append(healthcare_rate)
 
-        if (
-            leave
-            and leave.holiday_status_id.leave_type_code == "VAC"
-            and "LVACA" in payslip.line_ids.mapped("code")
-        ):  # field 55
-            line += self._format_number(0, 9)
-        else:
-            line += self._format_number(
-                self._round_to_nearest(ibc_total * healthcare_rate, 100), 9
-            )
+        # field 55
+        values.append(0)
 
-        line += self._format_number(0, 9)
-        line += self._format_string("", 15)
-        line += self._format_number(0, 9)
-        line += self._format_string("", 15)
-        line += self._format_number(0, 9)
-        job_risk_rate = self._get_arl_value(contract)
-        line += (
-            self._format_float(job_risk_rate, 9)
-            if not leave
-            else self._format_float(0, 9)
-        )  # field 61
-        line += self._format_number(self._get_work_center(contract), 9)
-        line += (
-            self._format_number(
-                self._round_to_nearest(ibc_total * job_risk_rate, 100), 9
-            )
-            if not leave
-            else self._format_number(0, 9)
-        )
+        # field 61, 62, 63
+        job_risk_rate = self._get_arl_value(snapshot) if not leave else 0
+        values += [job_risk_rate, self._get_work_center(snapshot), 0]
 
+        # field 64, 65
         ccf_rate = self._get_percentage(payslip, "APORTE_CAJA_COMP")
-        line += (
-            self._format_float(ccf_rate, 7)
-            if not leave or leave.holiday_status_id.leave_type_code in ("VAC", "LR")
-            else self._format_float(0, 7)
-        )
-
-        # field 65
-        if leave and leave.holiday_status_id.leave_type_code in (
-            "IGE",
-            "LMA",
-            "SLN",
-            "IRP",
-        ):
-            line += self._format_number(0, 9)
-        else:
-            line += self._format_number(
-                self._round_to_nearest(ibc_ccf * ccf_rate, 100), 9
-            )
+        values += [
+            ccf_rate if not leave or leave_type_code in ("VAC", "LR") else 0,
+            0,
+        ]
 
-        # field 66, 67
-        if not leave or leave.holiday_status_id.leave_type_code in ("VAC", "LR"):
+        # field 66, 67, 68, 69
+        if not leave or leave_type_code in ("VAC", "LR"):
             sena_rate = self._get_percentage(payslip, "AP_SENA")
-            line += self._format_float(sena_rate, 7)
-            line += self._format_number(
-                self._round_to_nearest(ibc_ccf * sena_rate, 100), 9
-            )
-        else:
-            line += self._format_float(0, 7)
-            line += self._format_number(0, 9)
-
-        # field 68, 69
-        if not leave or leave.holiday_status_id.leave_type_code in ("VAC", "LR"):
             icbf_rate = self._get_percentage(payslip, "AP_ICFB")
-            line += self._format_float(icbf_rate, 7)
-            line += self._format_number(
-                self._round_to_nearest(ibc_ccf * icbf_rate, 100), 9
-            )
         else:
-            line += self._format_float(0, 7)
-            line += self._format_number(0, 9)
-
-        line += self._format_float(0, 7)
-        line += self._format_number(0, 9)
-        line += self._format_float(0, 7)
-        line += self._format_number(0, 9)
-        line += self._format_string(" ", 2)
-        line += self._format_string(" ", 16)
+            sena_rate = icbf_rate = 0
+        values += [sena_rate, 0, icbf_rate, 0]
+
+        inputs = ContributionInput(
+            ibc=ibc_total,
+            ibc_ccf=ibc_ccf,
+            pension_rate=pension_rate if not no_vacation_contribution else 0,
+            health_rate=healthcare_rate if not no_vacation_contribution else 0,
+            arl_rate=job_risk_rate,
+            ccf_rate=(
+                ccf_rate
+                if leave_type_code not in ("IGE", "LMA", "SLN", "IRP")
+                else 0
+            ),
+            sena_rate=sena_rate,
+            icbf_rate=icbf_rate,
+            solidarity=self._get_line_total(payslip, "aut_solidaridad_sol"),
+            subsistence=self._get_line_total(payslip, "aut_solidaridad_subs"),
+        )
 
+        # field 76
         if (
-            payslip.line_ids.filtered(lambda l: l.code == "COND_APORT_EMP").amount
-            > payslip.line_ids.filtered(lambda l: l.code == "SMLMV_10").amount
-            or "SAL_INT" in contract.struct_id.code
-            or "APR" in contract.struct_id.code
+            lookup.amount("COND_APORT_EMP") > lookup.amount("SMLMV_10")
+            or snapshot.has_integral
+            or snapshot.apprentice
         ):
             field_76 = "N"
         else:
             field_76 = "S"
 
-        line += field_76
-        line += self._format_string(
-            contract.occupational_risks_accounting_partner_id.administration_code, 6
-        )
-        line += self._get_arl_number(contract)  # field 78
-        line += " "
-        line += (
-            self._format_datetime(contract.date_start)
-            if contract_start
-            else self._format_datetime(self._find_start_first_leave(employee, "ING"))
-        )
-        line += (
-            self._format_datetime(contract.date_end)
-            if contract_end
-            else self._format_datetime(self._find_start_first_leave(employee, "RET"))
-        )  # field 81
-        line += self._format_datetime(self._find_start_first_leave(employee, "VSP"))
-        line += self._format_datetime_for_leave(
-            employee, leave, "SLN", start_first_leave=True
-        )  # field 83
-        line += self._format_datetime_for_leave(
-            employee, leave, "SLN", start_first_leave=False
-        )
-        line += self._format_datetime_for_leave(
-            employee, leave, "IGE", start_first_leave=True
-        )
-        line += self._format_datetime_for_leave(
-            employee, leave, "IGE", start_first_leave=False
-        )
-        line += self._format_datetime_for_leave(
-            employee, leave, "LMA", start_first_leave=True
-        )  # field 87
-        line += self._format_datetime_for_leave(
-            employee, leave, "LMA", start_first_leave=False
-        )
+        values += [
+            field_76,
+            administration_codes["occupational_risks_accounting_partner_id"],
+            self._get_arl_number(snapshot),  # field 78
+        ]
 
-        if leave and leave.holiday_status_id.leave_type_code == "VAC":
-            line += self._format_datetime(self._find_start_first_leave(employee, "VAC"))
-            line += self._format_datetime(self._find_end_first_leave(employee, "VAC"))
-        elif leave and leave.holiday_status_id.leave_type_code == "LR":
-            line += self._format_datetime(self._find_start_first_leave(employee, "LR"))
-            line += self._format_datetime(self._find_end_first_leave(employee, "LR"))
-        else:
-            line += self._format_datetime(None)
-            line += self._format_datetime(None)
+        values += [
+            self._format_datetime(snapshot.contract_start)  # field 80
+            if snapshot.contract_start
+            else self._format_datetime(leaves.first_start(employee, "ING")),
+            self._format_datetime(snapshot.contract_end)
+            if snapshot.contract_end
+            else self._format_datetime(leaves.first_start(employee, "RET")),
+            self._format_datetime(leaves.first_start(employee, "VSP")),
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "SLN", start_first_leave=True
+            ),  # field 83
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "SLN", start_first_leave=False
+            ),
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "IGE", start_first_leave=True
+            ),
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "IGE", start_first_leave=False
+            ),
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "LMA", start_first_leave=True
+            ),  # field 87
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "LMA", start_first_leave=False
+            ),
+        ]
 
-        line += self._format_datetime(None)  # field 91
-        line += self._format_datetime(None)
-        line += self._format_datetime_for_leave(
-            employee, leave, "IRP", start_first_leave=True
-        )
-        line += self._format_datetime_for_leave(
-            employee, leave, "IRP", start_first_leave=False
-        )
+        # field 89, 90
+        if leave_type_code in ("VAC", "LR"):
+            values += [
+                self._format_datetime(leaves.first_start(employee, leave_type_code)),
+                self._format_datetime(leaves.first_end(employee, leave_type_code)),
+            ]
+        else:
+            values += [self._format_datetime(None), self._format_datetime(None)]
+
+        values += [
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "IRP", start_first_leave=True
+            ),  # field 93
+            self._format_datetime_for_leave(
+                leaves, employee, leave, "IRP", start_first_leave=False
+            ),
+        ]
 
         # field 95
-        if field_76 == "S" or "APR" in contract.struct_id.code:
-            line += self._format_number(0, 9)
+        if field_76 == "S" or snapshot.apprentice:
+            values.append(0)
         else:
-            line += self._format_number(ibc_ccf, 9)
+            values.append(ibc_ccf)
 
         # field 96
-        if (
-            "APR" in payslip.line_ids.mapped("code")
-            or "APR_E" in contract.struct_id.code
-        ):
-            line += self._format_number(0, 3)
+        if lookup.has_code("APR") or snapshot.apprentice_e:
+            values.append(0)
         elif not leave:
-            line += self._format_number(
-                self._get_hours_for_worked_days_with_codes(payslip, "WORK100"), 3
-            )
-        elif leave and leave.holiday_status_id.leave_type_code == "VAC":
-            line += self._format_number(
+            values.append(self._get_hours_for_worked_days_with_codes(payslip, "WORK100"))
+        elif leave_type_code == "VAC":
+            values.append(
                 self._get_hours_for_worked_days_with_codes(
                     payslip, ("VACAC", "VACAH", "VACAS", "VACAP")
-                ),
-                3,
-            )
-        elif leave and leave.holiday_status_id.leave_type_code == "LR":
-            line += self._format_number(
-                self._get_hours_for_worked_days_with_codes(payslip, "I_152"), 3
+                )
             )
+        elif leave_type_code == "LR":
+            values.append(self._get_hours_for_worked_days_with_codes(payslip, "I_152"))
         else:
-            line += self._format_number(0, 3)
-
-        line += "\r\n"
+            values.append(0)
+
+        return values, inputs, ibc_ccf
+
+    def _set_contributions(self, values, contribution):
+        """ Put the amounts of a Contribution in the values of its line. """
+        for name, value in (
+            ("pension_contribution", contribution.pension),
+            ("pension_total", contribution.pension),
+            ("solidarity_fund", contribution.solidarity),
+            ("subsistence_fund", contribution.subsistence),
+            ("health_contribution", contribution.health),
+            ("arl_contribution", contribution.arl),
+            ("ccf_contribution", contribution.ccf),
+            ("sena_contribution", contribution.sena),
+            ("icbf_contribution", contribution.icbf),
+        ):
+            values[DETAIL_LAYOUT.position(name)] = value
+
+    def _render_payslips(self, payslips, leaves=None):
+        """ Yield ``(payslip_id, lines)`` for every payslip, ``lines`` being the
+        list of ``(leave_id, line, ibc_ccf, subtotals)`` of the payslip's detail
+        lines, ``subtotals`` the ``((kind, administration code), amount)`` of the
+        contributions of the line.
+
+        Lines are rendered with sequence 0 and numbered once all the lines of
+        the file are put together.
+        """
+        employees = payslips.mapped("employee_id")
+        if leaves is None:
+            leaves = self._get_leave_index(employees)
+        snapshots = self._get_employee_snapshots(employees)
+        for batch in split_every(CONTRIBUTION_BATCH, payslips):
+            # the contributions of all the lines of a batch are computed at once
+            prepared = []
+            inputs = []
+            for payslip in batch:
+                employee = payslip.employee_id
+                snapshot = snapshots[employee.id]
+                to_prepare = []
+                if self._get_number_of_worked_days(payslip) > 0:
+                    to_prepare.append(None)
+                to_prepare += self._get_leaves_needing_separate_lines(leaves, employee)
+
+                lines = []
+                for leave in to_prepare:
+                    values, line_inputs, ibc_ccf = self._prepare_line(
+                        0, payslip, leave, leaves, snapshot
+                    )
+                    lines.append((leave.id if leave else None, values, ibc_ccf))
+                    inputs.append(line_inputs)
+                prepared.append((payslip.id, snapshot, lines))
+
+            contributions = iter(compute_contributions(inputs))
+            for payslip_id, snapshot, lines in prepared:
+                codes = snapshot.administration_codes
+                rendered = []
+                for leave_id, values, ibc_ccf in lines:
+                    contribution = next(contributions)
+                    self._set_contributions(values, contribution)
+                    rendered.append(
+                        (
+                            leave_id,
+                            DETAIL_LAYOUT.render(values),
+                            ibc_ccf,
+                            administrator_subtotals(contribution, codes),
+                        )
+                    )
+                yield payslip_id, rendered
 
-        return line, ibc_ccf
+    def _get_payslip_fingerprint(self, payslip, leaves):
+        """ Digest of everything the lines of ``payslip`` are rendered from. """
+        employee = payslip.employee_id
+        partner = employee.address_home_id
+        contract = employee.contract_id
+        data = (
+            LINE_CACHE_VERSION,
+            self.payslip_date_start,
+            self.payslip_date_end,
+            self.env.context.get("tz") or self.env.user.tz,
+            payslip.write_date,
+            [
+                (line.code, line.category_id.code, line.total, line.amount, line.rate)
+                for line in payslip.line_ids
+            ],
+            [
+                (line.code, line.number_of_days, line.number_of_hours)
+                for line in payslip.worked_days_line_ids
+            ],
+            contract.id,
+            contract.write_date,
+            contract.struct_id.code,
+            contract.pension_accounting_partner_id.administration_code,
+            contract.social_security_accounting_partner_id.administration_code,
+            contract.family_compensation_accounting_partner_id.administration_code,
+            contract.occupational_risks_accounting_partner_id.administration_code,
+            partner.id,
+            partner.write_date,
+            self.env["res.city"]._get_city_info(partner.city_id.id),
+            [
+                (
+                    leave.id,
+                    leave.write_date,
+                    leave.holiday_status_id.leave_type_code,
+                    leave.holiday_status_id.salary_rule_ids.mapped("code"),
+                )
+                for leave in leaves.all(employee)
+            ],
+        )
+        return hashlib.sha1(repr(data).encode("utf-8")).hexdigest()
+
+    def _get_payslip_shards(self, payslips, count):
+        """ Split ``payslips`` in about ``count`` shards of consecutive payslips.
+        Consecutive payslips of an employee are kept in the same shard. """
+        size = int(math.ceil(len(payslips) / float(count))) or 1
+        shards = [[]]
+        previous_employee = None
+        for payslip in payslips:
+            employee = payslip.employee_id
+            if len(shards[-1]) >= size and employee != previous_employee:
+                shards.append([])
+            shards[-1].append(payslip.id)
+            previous_employee = employee
+        return shards
+
+    def _render_payslips_parallel(self, payslips):
+        """ Same as _render_payslips, but every shard of payslips is rendered
+        by a worker process reading the snapshot of the current transaction. """
+        snapshot = parallel.export_snapshot(self.env.cr)
+        tasks = [
+            (
+                self.env.cr.dbname,
+                self.env.uid,
+                dict(self.env.context),
+                self.id,
+                snapshot,
+                shard,
+            )
+            for shard in self._get_payslip_shards(
+                payslips, self.processes * SHARDS_PER_PROCESS
+            )
+        ]
+        for rendered in parallel.imap(_render_shard, tasks, self.processes):
+            for payslip_lines in rendered:
+                yield payslip_lines
+
+    def _render_payslips_cached(self, payslips):
+        """ Same as _render_payslips, but the lines of a payslip are only
+        rendered when the cached ones don't match its fingerprint anymore. The
+        lines rendered are saved in the cache. """
+        LineCache = self.env["co_payroll.autoliquidacion_line"]
+        leaves = self._get_leave_index(payslips.mapped("employee_id"))
+        fingerprints = {
+            payslip.id: self._get_payslip_fingerprint(payslip, leaves)
+            for payslip in payslips
+        }
+        cached = LineCache._get_cached_lines(fingerprints)
 
-    def _generate_lines(self):
+        stale = payslips.filtered(lambda payslip: payslip.id not in cached)
+        if self.processes > 1 and len(stale) > 1:
+            rendered = self._render_payslips_parallel(stale)
+        else:
+            rendered = self._render_payslips(stale, leaves)
+
+        to_store = []
+        for payslip in payslips:
+            if payslip.id in cached:
+                yield payslip.id, cached.pop(payslip.id)
+                continue
+
+            payslip_id, lines = next(rendered)
+            to_store.append((payslip_id, fingerprints[payslip_id], lines))
+            if len(to_store) >= LINE_CACHE_BATCH:
+                LineCache._store_lines(to_store)
+                to_store = []
+            yield payslip_id, lines
+        if to_store:
+            LineCache._store_lines(to_store)
+
+    def _iter_lines(self, progress=None, checkpoint=None):
+        """ Yield ``(line, ibc_ccf, subtotals)`` for every detail line of the
+        file.
+
+        :param progress: optional callable, called after each payslip with the
+            number of payslips processed and lines written so far
+        :param checkpoint: optional callable, called after each chunk of
+            payslips, once its lines are in the cache
+        """
+        payslip_nr = 0
         line_nr = 0
-        lines = ""
-        total_ibc_ccf = 0
-        for payslip in self._get_payslips():
-            if self._get_number_of_worked_days(payslip) > 0:
-                line, ibc_ccf = self._generate_line(line_nr, payslip, None)
-                lines += line
-                total_ibc_ccf += ibc_ccf
-                line_nr += 1
+        for payslips in self._iter_payslip_chunks():
+            for payslip_id, lines in self._render_payslips_cached(payslips):
+                for leave_id, line, ibc_ccf, subtotals in lines:
+                    line = DETAIL_LAYOUT.replace_field(line, "sequence", line_nr)
+                    yield line, ibc_ccf, subtotals
+                    line_nr += 1
+                payslip_nr += 1
+                if progress:
+                    progress(payslip_nr, line_nr)
+            if checkpoint:
+                checkpoint()
+
+    def _write_file(self, fp, progress=None, checkpoint=None):
+        """ Write the file to the binary file object ``fp``, one line at a time.
+
+        Field 20 of the header is the sum of every field 45 in the lines. It is
+        written back in place once the last line has been written.
+
+        Return the subtotals of the contributions by administrator, as
+        ``{(kind, administration code): amount}``.
+        """
+        header = self._generate_header()
+        fp.write(header.upper().encode("utf-8"))
 
-            for leave in self._get_leaves_needing_separate_lines(payslip.employee_id):
-                line, ibc_ccf = self._generate_line(line_nr, payslip, leave)
-                lines += line
-                total_ibc_ccf += ibc_ccf
-                line_nr += 1
+        total_ibc_ccf = 0
+        subtotals = defaultdict(int)
+        for line, ibc_ccf, line_subtotals in self._iter_lines(
+            progress=progress, checkpoint=checkpoint
+        ):
+            fp.write(line.upper().encode("utf-8"))
+            total_ibc_ccf += ibc_ccf
+            for key, amount in line_subtotals:
+                subtotals[key] += amount
+
+        # the byte offset of field 20 differs from its position in the record
+        # when the company name contains multibyte characters
+        offset = HEADER_LAYOUT.offset("total_payroll")
+        fp.seek(len(header[:offset].upper().encode("utf-8")))
+        fp.write(
+            HEADER_LAYOUT.format_field("total_payroll", total_ibc_ccf).encode("utf-8")
+        )
+        fp.seek(0, io.SEEK_END)
+        return dict(subtotals)
+
+    def _format_subtotals(self, subtotals):
+        """ Text of the subtotals returned by _write_file, one per line. """
+        return "\n".join(
+            "%s %s: %s" % (kind, code, amount)
+            for (kind, code), amount in sorted(subtotals.items())
+        )
 
-        return lines, total_ibc_ccf
+    def _create_attachment(
+        self,
+        res_model=False,
+        res_id=False,
+        progress=None,
+        checkpoint=None,
+        before_save=None,
+    ):
+        """ Write the file and create its attachment.
 
-    @api.multi
-    def generate(self):
+        :param progress, checkpoint: see _iter_lines
+        :param before_save: optional callable, called once the file is written
+            and before the attachment is created
+        """
         IrAttachment = self.env["ir.attachment"]
-        ATTACHMENT_NAME = "autoliquidacion_report.txt"
-
-        header = self._generate_header()
-        lines, total_ibc_ccf = self._generate_lines()
-
-        # fill field 20 in the header which is the sum of every field 45 in the lines
-        # field 20 is at pos 343-354 (starting from 0)
-        header = header[:343] + self._format_number(total_ibc_ccf, 12) + header[355:]
 
-        file_content = header
-        file_content += lines
-        file_content = file_content.upper()
-
-        # clean old attachment
-        IrAttachment.search([("name", "=", ATTACHMENT_NAME)]).unlink()
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as content:
+            subtotals = self._write_file(
+                content, progress=progress, checkpoint=checkpoint
+            )
+            if before_save:
+                before_save()
+            content.seek(0)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as datas:
+                base64.encode(content, datas)
+                datas.seek(0)
+
+                # clean old attachment (files of background jobs are linked to
+                # their job and kept)
+                if not res_model:
+                    IrAttachment.search(
+                        [("name", "=", ATTACHMENT_NAME), ("res_model", "=", False)]
+                    ).unlink()
+
+                return IrAttachment.create(
+                    {
+                        "name": ATTACHMENT_NAME,
+                        "datas": datas.read(),
+                        "datas_fname": ATTACHMENT_NAME,
+                        "res_model": res_model,
+                        "res_id": res_id,
+                        "description": self._format_subtotals(subtotals),
+                    }
+                )
 
-        created_attachment = IrAttachment.create(
-            {
-                "name": ATTACHMENT_NAME,
-                "datas": base64.encodestring(file_content.encode("utf-8")),
-                "datas_fname": ATTACHMENT_NAME,
-            }
-        )
+    def _get_job_parameters(self):
+        """ Parameters of the wizard, as given to a background job. """
+        return json.dumps(self.copy_data()[0], default=fields.Date.to_string)
 
+    @api.multi
+    def generate(self):
+        created_attachment = self._create_attachment()
         return {
             "type": "ir.actions.act_url",
             "target": "self",
             "url": "/web/content/%s?download=1" % created_attachment.id,
         }
+
+    @api.multi
+    def generate_in_background(self):
+        """ Queue the generation of the file in a background job. The job is
+        processed by a scheduled action and reports its progress. """
+        self.ensure_one()
+        job = self.env["co_payroll.autoliquidacion_job"].create(
+            {"parameters": self._get_job_parameters()}
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": job._name,
+            "res_id": job.id,
+            "view_mode": "form",
+            "target": "current",
+        }
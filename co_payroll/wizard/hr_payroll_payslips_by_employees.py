@@ -0,0 +1,69 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from odoo import api, models, _
+from odoo.exceptions import UserError
+
+
+class HrPayslipEmployees(models.TransientModel):
+    _inherit = "hr.payslip.employees"
+
+    @api.multi
+    def compute_sheet(self):
+        """ Same as hr_payroll, but all payslips are created at once and their
+        worked days and input lines are inserted in bulk.
+
+        super() isn't called, so the journal of the batch is put in the context
+        of the payslips here, as hr_payroll_account does.
+        """
+        [data] = self.read()
+        active_id = self.env.context.get("active_id")
+        journal_id = self.env.context.get("journal_id")
+        if active_id:
+            journal_id = self.env["hr.payslip.run"].browse(active_id).journal_id.id
+        Payslip = self.env["hr.payslip"].with_context(
+            journal_id=journal_id, bulk_payslip_lines=True
+        )
+        run_data = {}
+        if active_id:
+            [run_data] = (
+                self.env["hr.payslip.run"]
+                .browse(active_id)
+                .read(["date_start", "date_end", "credit_note"])
+            )
+        from_date = run_data.get("date_start")
+        to_date = run_data.get("date_end")
+        if not data["employee_ids"]:
+            raise UserError(_("You must select employee(s) to generate payslip(s)."))
+
+        vals_list = []
+        for employee in self.env["hr.employee"].browse(data["employee_ids"]):
+            slip_data = Payslip.onchange_employee_id(
+                from_date, to_date, employee.id, contract_id=False
+            )
+            vals_list.append(
+                {
+                    "employee_id": employee.id,
+                    "name": slip_data["value"].get("name"),
+                    "struct_id": slip_data["value"].get("struct_id"),
+                    "contract_id": slip_data["value"].get("contract_id"),
+                    "payslip_run_id": active_id,
+                    "input_line_ids": [
+                        (0, 0, x) for x in slip_data["value"].get("input_line_ids")
+                    ],
+                    "worked_days_line_ids": [
+                        (0, 0, x)
+                        for x in slip_data["value"].get("worked_days_line_ids")
+                    ],
+                    "date_from": from_date,
+                    "date_to": to_date,
+                    "credit_note": run_data.get("credit_note"),
+                    "company_id": employee.company_id.id,
+                }
+            )
+        payslips = Payslip.create(vals_list).with_context(bulk_payslip_lines=False)
+        run = self.env["hr.payslip.run"].browse(active_id)
+        if run:
+            run._compute_sheets(payslips)
+        else:
+            payslips.compute_sheet()
+        return {"type": "ir.actions.act_window_close"}
@@ -0,0 +1,64 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+import base64
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .master_data_loader import MasterDataLoader
+
+
+class MasterDataImportWizard(models.TransientModel):
+    _name = "co_payroll.master_data_import"
+    _description = "Payroll Master Data Import Wizard"
+
+    attachment_ids = fields.Many2many(
+        "ir.attachment",
+        string="Archivos",
+        help="Payroll master data spreadsheets, e.g. 03_hr.salary.rule.xlsx. They "
+        "are loaded in dependency order whatever the order they are given in.",
+    )
+    result = fields.Text(string="Resultado", readonly=True)
+
+    @api.multi
+    def action_import(self):
+        self.ensure_one()
+        if not self.attachment_ids:
+            raise UserError(_("Add the files to import first."))
+
+        files = [
+            (
+                attachment.datas_fname or attachment.name,
+                base64.b64decode(attachment.datas),
+            )
+            for attachment in self.attachment_ids
+        ]
+        stats = MasterDataLoader(self.env).load(files)
+        lines = []
+        for file_stats in stats:
+            lines.append(
+                _("%s (%s): %s rows, %s created, %s updated, %s unchanged in %.2fs")
+                % (
+                    file_stats.filename,
+                    file_stats.model,
+                    file_stats.rows,
+                    file_stats.created,
+                    file_stats.updated,
+                    file_stats.unchanged,
+                    file_stats.elapsed_time,
+                )
+            )
+            if file_stats.ignored_columns:
+                lines.append(
+                    _("    Ignored columns: %s") % ", ".join(file_stats.ignored_columns)
+                )
+            lines += ["    %s" % error for error in file_stats.errors]
+        self.result = "\n".join(lines)
+
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
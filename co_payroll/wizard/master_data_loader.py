@@ -0,0 +1,418 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from collections import namedtuple
+import io
+import logging
+import re
+import time
+
+from odoo import tools, _
+from odoo.exceptions import UserError
+from odoo.tools import split_every
+
+from ..models.hr import normalize_name
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+_logger = logging.getLogger(__name__)
+
+# rows converted and saved together
+LOAD_BATCH = 200
+
+# a master data file: the name of the file without its number and extension,
+# the model it is loaded in, the sheet to read (the first one by default) and
+# the columns named after their label instead of the field
+MasterDataFile = namedtuple("MasterDataFile", ["stem", "model", "sheet", "columns"])
+
+# in dependency order
+MASTER_DATA_FILES = [
+    MasterDataFile("hr.salary.rule.category", "hr.salary.rule.category", None, {}),
+    MasterDataFile("hr.holidays.status", "hr.leave.type", None, {}),
+    MasterDataFile("hr.salary.rule", "hr.salary.rule", "Import", {}),
+    MasterDataFile("hr.rule.input", "hr.rule.input", None, {}),
+    MasterDataFile("hr.payroll.structure", "hr.payroll.structure", None, {}),
+    MasterDataFile(
+        "res.country.state",
+        "res.country.state",
+        None,
+        {
+            "External ID": "id",
+            "State Name": "name",
+            "Country": "country_id/id",
+            "State Code": "code",
+        },
+    ),
+    MasterDataFile(
+        "res.city",
+        "res.city",
+        None,
+        {
+            "ID Externo": "id",
+            "Ciudad": "name",
+            "Código de Ciudad": "code",
+            "Estado": "state_id",
+            "País": "country_id",
+        },
+    ),
+]
+
+# statistics of a loaded file
+LoadStats = namedtuple(
+    "LoadStats",
+    [
+        "filename",
+        "model",
+        "rows",
+        "created",
+        "updated",
+        "unchanged",
+        "errors",
+        "ignored_columns",
+        "elapsed_time",
+    ],
+)
+
+
+def get_master_data_file(filename):
+    """ Return the MasterDataFile of ``filename``, e.g. 07_res.city.xls. """
+    stem = re.sub(r"^\d+_", "", filename.rsplit(".", 1)[0])
+    for spec in MASTER_DATA_FILES:
+        if spec.stem == stem:
+            return spec
+    return None
+
+
+def _cell_value(cell):
+    """ Text value of an xlrd cell, numbers converted as the import of Odoo
+    does. """
+    if cell.ctype == xlrd.XL_CELL_NUMBER:
+        if cell.value % 1 == 0.0:
+            return str(int(cell.value))
+        return str(cell.value)
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return str(bool(cell.value))
+    return str(cell.value).strip() if cell.value is not None else ""
+
+
+def _value_text(value):
+    """ Same as _cell_value, for a value read by openpyxl. """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float) and value % 1 == 0.0:
+        return str(int(value))
+    return str(value).strip()
+
+
+class MasterDataLoader(object):
+    """ Load the payroll master data spreadsheets, exported from another
+    database, in their models.
+
+    Records are matched on their external id: the new ones are created by
+    batches, the ones of which a value changed are written and the others are
+    left alone. References to other records are given by external id
+    (``field/id`` columns) or by name (states and countries of the cities).
+    """
+
+    def __init__(self, env):
+        if xlrd is None:
+            raise UserError(_("The xlrd library is needed to read the files."))
+        self.env = env
+        self._xmlids = {}
+        self._names = {}
+        self._selections = {}
+
+    def load(self, files):
+        """ Load ``files``, a list of ``(filename, content)``, in dependency
+        order and return the LoadStats of every file. """
+        specs = []
+        for filename, content in files:
+            spec = get_master_data_file(filename)
+            if not spec:
+                raise UserError(_("%s is not a payroll master data file.") % filename)
+            specs.append((MASTER_DATA_FILES.index(spec), filename, content, spec))
+
+        stats = []
+        for index, filename, content, spec in sorted(specs, key=lambda s: s[0]):
+            stats.append(self._load_file(filename, content, spec))
+            _logger.info(
+                "Loaded %s in %s: %s rows, %s created, %s updated, %s unchanged, "
+                "%s errors in %.2fs",
+                filename,
+                spec.model,
+                stats[-1].rows,
+                stats[-1].created,
+                stats[-1].updated,
+                stats[-1].unchanged,
+                len(stats[-1].errors),
+                stats[-1].elapsed_time,
+            )
+        return stats
+
+    def _read_rows(self, filename, content, spec):
+        """ Return the name of the sheet to load and an iterator on its rows,
+        the header first.
+
+        .xlsx files are read row by row by openpyxl when it is installed. The
+        .xls format can only be parsed whole: xlrd loads the sheet to load,
+        and only that one.
+        """
+        if openpyxl and filename.lower().endswith(".xlsx"):
+            book = openpyxl.load_workbook(
+                io.BytesIO(content), read_only=True, data_only=True
+            )
+            sheet = book[spec.sheet] if spec.sheet else book.worksheets[0]
+            rows = (
+                [_value_text(value) for value in row]
+                for row in sheet.iter_rows(values_only=True)
+            )
+            return sheet.title, rows
+
+        book = xlrd.open_workbook(file_contents=content, on_demand=True)
+        if spec.sheet:
+            sheet = book.sheet_by_name(spec.sheet)
+        else:
+            sheet = book.sheet_by_index(0)
+        rows = (
+            [_cell_value(cell) for cell in sheet.row(index)]
+            for index in range(sheet.nrows)
+        )
+        return sheet.name, rows
+
+    def _load_file(self, filename, content, spec):
+        started = time.time()
+        Model = self.env[spec.model]
+        sheet_name, rows = self._read_rows(filename, content, spec)
+        header = [spec.columns.get(column, column) for column in next(rows)]
+
+        columns = []
+        ignored = []
+        for position, column in enumerate(header):
+            name = column[: -len("/id")] if column.endswith("/id") else column
+            if column == "id" or name in Model._fields:
+                columns.append((position, column))
+            elif column:
+                ignored.append(column)
+        # states are looked up by name in the country of the row
+        columns.sort(key=lambda column: not column[1].startswith("country_id"))
+
+        counts = {"rows": 0, "created": 0, "updated": 0, "unchanged": 0}
+        errors = []
+        for batch in split_every(LOAD_BATCH, enumerate(rows, 2)):
+            data_list = []
+            for row_number, row in batch:
+                if not any(row):
+                    continue
+                counts["rows"] += 1
+                try:
+                    data_list.append(self._convert_row(Model, columns, header, row))
+                except UserError as e:
+                    errors.append(
+                        _("Sheet %s, row %s: %s") % (sheet_name, row_number, e.name)
+                    )
+
+            # a batch that can't be saved is reported, the others are kept
+            batch_counts = dict.fromkeys(("created", "updated", "unchanged"), 0)
+            try:
+                with self.env.cr.savepoint():
+                    self._save(Model, data_list, batch_counts)
+            except Exception as e:
+                Model.invalidate_cache()
+                errors.append(
+                    _("Sheet %s, rows %s to %s: %s")
+                    % (sheet_name, batch[0][0], batch[-1][0], tools.ustr(e))
+                )
+                continue
+            for key, count in batch_counts.items():
+                counts[key] += count
+
+        return LoadStats(
+            filename,
+            spec.model,
+            counts["rows"],
+            counts["created"],
+            counts["updated"],
+            counts["unchanged"],
+            errors,
+            ignored,
+            time.time() - started,
+        )
+
+    def _convert_row(self, Model, columns, header, row):
+        """ Return the ``{"xml_id": ..., "values": ...}`` of a row. Errors are
+        raised as UserError naming the column. """
+        xml_id = None
+        values = {}
+        for position, column in columns:
+            value = row[position] if position < len(row) else ""
+            if column == "id":
+                if value:
+                    xml_id = value if "." in value else "__import__.%s" % value
+                continue
+            try:
+                self._convert_column(Model, column, value, values)
+            except UserError as e:
+                raise UserError(_("Column %s: %s") % (header[position], e.name))
+            except (ValueError, TypeError) as e:
+                raise UserError(
+                    _("Column %s: %s is not a valid value (%s)")
+                    % (header[position], value, tools.ustr(e))
+                )
+
+        if not xml_id:
+            raise UserError(_("The row has no external id."))
+        return {"xml_id": xml_id, "values": values}
+
+    def _convert_column(self, Model, column, value, values):
+        """ Convert the ``value`` of ``column`` into ``values``. """
+        if column.endswith("/id"):
+            name = column[: -len("/id")]
+            field = Model._fields[name]
+            ids = [
+                self._get_xmlid(field.comodel_name, xmlid)
+                for xmlid in value.split(",")
+                if xmlid
+            ]
+            if field.type == "many2many":
+                values[name] = [(6, 0, ids)]
+            else:
+                values[name] = ids[0] if ids else False
+        else:
+            field = Model._fields[column]
+            values[column] = self._convert_value(field, value, values)
+
+    def _convert_value(self, field, value, values):
+        if field.type == "boolean":
+            return value.lower() in ("1", "true", "yes", "si", "sí")
+        if field.type == "integer":
+            return int(float(value)) if value else 0
+        if field.type in ("float", "monetary"):
+            return float(value) if value else 0.0
+        if field.type == "selection":
+            return self._get_selection_key(field, value)
+        if field.type == "many2one":
+            return self._get_by_name(field, value, values)
+        return value or False
+
+    def _get_xmlids(self, model):
+        """ Return ``{xmlid: res_id}`` for all the external ids of ``model``,
+        read the first time. """
+        if model not in self._xmlids:
+            self._xmlids[model] = {
+                "%s.%s" % (data["module"], data["name"]): data["res_id"]
+                for data in self.env["ir.model.data"]
+                .sudo()
+                .search_read([("model", "=", model)], ["module", "name", "res_id"])
+            }
+        return self._xmlids[model]
+
+    def _get_xmlid(self, model, xmlid):
+        if "." not in xmlid:
+            xmlid = "__import__.%s" % xmlid
+        res_id = self._get_xmlids(model).get(xmlid)
+        if not res_id:
+            raise UserError(_("No %s found with external id %s.") % (model, xmlid))
+        return res_id
+
+    def _get_selection_key(self, field, value):
+        """ Selection values may be given by key or by label, in English or in
+        the language of the user. """
+        if not value:
+            return False
+        if field not in self._selections:
+            keys = {}
+            for lang in {"en_US", self.env.lang or "en_US"}:
+                env = self.env(context=dict(self.env.context, lang=lang))
+                for key, label in field._description_selection(env):
+                    keys[key] = key
+                    keys[label] = key
+            self._selections[field] = keys
+        if value not in self._selections[field]:
+            raise UserError(_("%s is not a value of %s.") % (value, field.string))
+        return self._selections[field][value]
+
+    def _get_by_name(self, field, value, values):
+        """ Resolve a record by its name. States and cities are looked up in
+        the indexes of res.country.state and res.city, within the country or
+        the state of the row. """
+        if not value:
+            return False
+        model = field.comodel_name
+        if model in ("res.country.state", "res.city"):
+            if model == "res.country.state":
+                index = self.env[model]._get_state_index()
+                key = (values.get("country_id") or False, normalize_name(value))
+            else:
+                index = self.env[model]._get_city_index()
+                key = (values.get("state_id") or False, normalize_name(value))
+            res_id = index.by_name.get(key)
+            if not res_id:
+                raise UserError(_("No %s found with name %s.") % (model, value))
+            return res_id
+
+        if model not in self._names:
+            index = {}
+            Comodel = self.env[model]
+            fields_read = ["name"]
+            if "country_id" in Comodel._fields:
+                fields_read.append("country_id")
+            for data in Comodel.search_read([], fields_read):
+                country_id = data.get("country_id") and data["country_id"][0]
+                index.setdefault((country_id, data["name"].lower()), data["id"])
+                index.setdefault((None, data["name"].lower()), data["id"])
+            self._names[model] = index
+        key = (values.get("country_id") or None, value.lower())
+        res_id = self._names[model].get(key)
+        if not res_id:
+            raise UserError(_("No %s found with name %s.") % (model, value))
+        return res_id
+
+    def _save(self, Model, data_list, counts):
+        """ Create the new records, write the changed ones. """
+        if not data_list:
+            return
+        xmlids = self._get_xmlids(Model._name)
+        existing = Model.browse(
+            [xmlids[data["xml_id"]] for data in data_list if data["xml_id"] in xmlids]
+        ).exists()
+        existing = {record.id: record for record in existing}
+
+        to_load = []
+        for data in data_list:
+            record = existing.get(xmlids.get(data["xml_id"]))
+            if record and self._is_unchanged(record, data["values"]):
+                counts["unchanged"] += 1
+                continue
+            counts["updated" if record else "created"] += 1
+            to_load.append(data)
+
+        if to_load:
+            records = Model._load_records(to_load)
+            for data, record in zip(to_load, records):
+                xmlids[data["xml_id"]] = record.id
+
+    def _is_unchanged(self, record, values):
+        for name, value in values.items():
+            field = record._fields[name]
+            current = record[name]
+            if field.type == "many2many":
+                if set(current.ids) != set(value[0][2]):
+                    return False
+            elif field.type == "many2one":
+                if current.id != (value or False):
+                    return False
+            elif field.type in ("float", "monetary"):
+                if abs((current or 0.0) - value) > 1e-9:
+                    return False
+            elif (current or False) != (value or False):
+                return False
+        return True
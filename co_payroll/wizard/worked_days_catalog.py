@@ -0,0 +1,75 @@
+# coding: utf-8
+# Copyright (C) 2019 Odoo Inc
+from odoo import api, fields, models
+
+
+class WorkedDaysCatalog(models.TransientModel):
+    _name = "co_payroll.worked_days_catalog"
+    _description = "Worked Days Catalog"
+
+    payslip_id = fields.Many2one("hr.payslip", required=True, readonly=True)
+    line_ids = fields.One2many(
+        "co_payroll.worked_days_catalog_line", "catalog_id", string="Días Trabajados"
+    )
+
+    @api.model
+    def default_get(self, fields_list):
+        """ Every code of the catalog of the payslip, the stored ones with
+        their days. """
+        res = super(WorkedDaysCatalog, self).default_get(fields_list)
+        payslip = self.env["hr.payslip"].browse(res.get("payslip_id"))
+        if payslip and "line_ids" in fields_list:
+            res["line_ids"] = [
+                (0, 0, vals) for vals in payslip._get_worked_days_catalog()
+            ]
+        return res
+
+    @api.multi
+    def action_save(self):
+        """ Write the days of the catalog to the worked days lines of the
+        payslip, in one write. Codes left at zero aren't stored in sparse
+        mode. """
+        self.ensure_one()
+        sparse = self.payslip_id.company_id.sparse_worked_days
+        commands = []
+        for line in self.line_ids:
+            vals = {
+                "number_of_days": line.number_of_days,
+                "number_of_hours": line.number_of_hours,
+            }
+            if line.line_id and sparse and not any(vals.values()):
+                commands.append((2, line.line_id.id))
+            elif line.line_id:
+                if (line.line_id.number_of_days, line.line_id.number_of_hours) != (
+                    line.number_of_days,
+                    line.number_of_hours,
+                ):
+                    commands.append((1, line.line_id.id, vals))
+            elif line.number_of_days or line.number_of_hours:
+                vals.update(
+                    name=line.name,
+                    code=line.code,
+                    sequence=line.sequence,
+                    contract_id=line.contract_id.id,
+                )
+                commands.append((0, 0, vals))
+        if commands:
+            self.payslip_id.write({"worked_days_line_ids": commands})
+        return {"type": "ir.actions.act_window_close"}
+
+
+class WorkedDaysCatalogLine(models.TransientModel):
+    _name = "co_payroll.worked_days_catalog_line"
+    _description = "Worked Days Catalog Line"
+    _order = "sequence"
+
+    catalog_id = fields.Many2one(
+        "co_payroll.worked_days_catalog", required=True, ondelete="cascade"
+    )
+    line_id = fields.Many2one("hr.payslip.worked_days", ondelete="cascade")
+    name = fields.Char(string="Description")
+    code = fields.Char()
+    sequence = fields.Integer()
+    contract_id = fields.Many2one("hr.contract")
+    number_of_days = fields.Float(string="Number of Days")
+    number_of_hours = fields.Float(string="Number of Hours")